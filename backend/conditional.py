@@ -0,0 +1,53 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+
+class ConditionalGetMixin:
+    """
+    ETag support for read endpoints.
+
+    The ETag comes from one aggregate query, COUNT plus MAX of the
+    `validator_fields` timestamps over get_validator_queryset(), so a 304
+    is answered without loading or serializing the rows. No Last-Modified
+    is sent: deleting or hiding a row never moves MAX(updated_at) forward,
+    so If-Modified-Since would answer 304 for a changed result.
+    """
+    validator_fields = ('updated_at',)
+
+    def get_validator_queryset(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def get_etag(self, request, *args, **kwargs):
+        queryset = self.get_validator_queryset(request, *args, **kwargs).order_by()
+        stats = queryset.aggregate(
+            count=Count('pk'),
+            **{f'max_{i}': Max(field) for i, field in enumerate(self.validator_fields)}
+        )
+        last_modified = max(
+            (stats[f'max_{i}'] for i in range(len(self.validator_fields)) if stats[f'max_{i}']),
+            default=None
+        )
+        # the URI covers filters, cursors and ?expand=; the user covers per-user views
+        seed = '|'.join([
+            request.build_absolute_uri(),
+            str(request.user.pk),
+            str(stats['count']),
+            last_modified.isoformat() if last_modified else '',
+        ])
+        return quote_etag(hashlib.sha1(seed.encode()).hexdigest())
+
+    def conditional_get(self, handler, request, *args, **kwargs):
+        # kept on the view so handlers can key caches on it
+        self.etag = etag = self.get_etag(request, *args, **kwargs)
+
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            response['ETag'] = etag
+        return response
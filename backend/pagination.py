@@ -0,0 +1,50 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Keyset pagination on (created_at, id), newest first.
+    Each page is a range scan on the matching index, so deep pages
+    cost the same as the first one.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class RankedResultsPagination(PageNumberPagination):
+    """
+    Page-number pagination for relevance-ranked results, which have
+    no stable key to build a cursor from.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for large admin changelists. An unfiltered listing of a big
+    table takes its count from the planner's row estimate instead of a
+    full COUNT(*) scan; filtered listings are still counted exactly.
+    """
+    exact_count_below = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            with connections[queryset.db].cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table]
+                )
+                estimate = cursor.fetchone()[0]
+            # reltuples is -1 until the table has been analyzed
+            if estimate >= self.exact_count_below:
+                return estimate
+        return super().count
@@ -54,6 +54,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'users.apps.UsersConfig',
     'products.apps.ProductsConfig',
@@ -156,10 +157,30 @@ DATABASES = {
         )
     }
 
+# Cache: Redis in production when REDIS_URL is set, local memory otherwise
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+# Seconds a cached product list/detail response is kept
+PRODUCT_CACHE_TIMEOUT = config('PRODUCT_CACHE_TIMEOUT', default=300, cast=int)
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    'DEFAULT_PAGINATION_CLASS': 'backend.pagination.CreatedAtCursorPagination',
+    'PAGE_SIZE': 20,
 }
 from datetime import timedelta
 
@@ -217,6 +238,15 @@ STORAGES = {
     },
 }
 MEDIA_URL = f"https://{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com/"
+# Optional CDN in front of the bucket, e.g. "https://cdn.example.com/";
+# product image URLs are built against it instead of the storage backend
+MEDIA_CDN_URL = config('MEDIA_CDN_URL', default='')
+
+# Responsive derivatives generated for every product image
+PRODUCT_IMAGE_WIDTHS = (320, 640, 1024)
+PRODUCT_IMAGE_FORMATS = ('webp', 'avif')
+# Concurrent uploads to storage per product create/update request
+PRODUCT_IMAGE_UPLOAD_WORKERS = config('PRODUCT_IMAGE_UPLOAD_WORKERS', default=4, cast=int)
 # # Optional: custom domain
 # AWS_S3_CUSTOM_DOMAIN = f"{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com"
 
@@ -240,6 +270,20 @@ STATIC_URL = 'static/'
 STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY')
 STRIPE_PUBLISHABLE_KEY = config('STRIPE_PUBLISHABLE_KEY')
 STRIPE_WEBHOOK_SECRET = config('STRIPE_WEBHOOK_SECRET', default='')
+# Checkout Sessions expire after this many seconds (Stripe allows 30 minutes to 24 hours)
+STRIPE_CHECKOUT_SESSION_TTL = config('STRIPE_CHECKOUT_SESSION_TTL', default=3600, cast=int)
+# Stock stays held this many seconds past its Checkout Session's expiry, so a
+# payment completed at the last moment is still fulfilled from the hold
+STOCK_RESERVATION_GRACE = config('STOCK_RESERVATION_GRACE', default=300, cast=int)
+# Outbound Stripe API calls (payments.gateway)
+STRIPE_API_BASE = config('STRIPE_API_BASE', default='https://api.stripe.com')
+STRIPE_CONNECT_TIMEOUT = config('STRIPE_CONNECT_TIMEOUT', default=3.0, cast=float)
+STRIPE_READ_TIMEOUT = config('STRIPE_READ_TIMEOUT', default=10.0, cast=float)
+STRIPE_MAX_RETRIES = config('STRIPE_MAX_RETRIES', default=2, cast=int)
+STRIPE_RETRY_BASE_DELAY = config('STRIPE_RETRY_BASE_DELAY', default=0.25, cast=float)
+# consecutive failures that open the circuit, and seconds before it is retried
+STRIPE_CIRCUIT_FAILURES = config('STRIPE_CIRCUIT_FAILURES', default=5, cast=int)
+STRIPE_CIRCUIT_RESET = config('STRIPE_CIRCUIT_RESET', default=30.0, cast=float)
 
 STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 # DEFAULT_FILE_STORAGE = "storages.backends.s3boto3.S3Boto3Storage"
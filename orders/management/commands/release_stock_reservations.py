@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.models import StockReservation
+
+
+class Command(BaseCommand):
+    help = "Delete expired checkout stock reservations in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--forever',
+            action='store_true',
+            help="Keep sweeping instead of exiting once nothing has expired"
+        )
+        parser.add_argument('--interval', type=float, default=30.0, help="Seconds to sleep when nothing has expired")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            released = StockReservation.objects.release_expired(options['batch_size'])
+            total += released
+            if released:
+                continue
+            if not options['forever']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f"Released {total} expired stock reservations"))
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:01
+
+from django.db import migrations
+from django.db.models import Count, Sum
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    Order = apps.get_model('orders', 'Order')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+
+    # fold extra pending orders into the newest one per user
+    duplicated_users = (
+        Order.objects.filter(status='PENDING')
+        .values('user').annotate(n=Count('id')).filter(n__gt=1)
+        .values_list('user', flat=True)
+    )
+    for user_id in duplicated_users:
+        keep, *extra = Order.objects.filter(user_id=user_id, status='PENDING').order_by('-id')
+        OrderItem.objects.filter(order__in=extra).update(order=keep)
+        Order.objects.filter(id__in=[o.id for o in extra]).update(status='CANCELLED')
+
+    # collapse repeated lines for the same product into one
+    duplicated_lines = (
+        OrderItem.objects.values('order', 'product')
+        .annotate(n=Count('id'), total=Sum('quantity')).filter(n__gt=1)
+    )
+    for line in duplicated_lines:
+        keep, *extra = OrderItem.objects.filter(order_id=line['order'], product_id=line['product']).order_by('id')
+        OrderItem.objects.filter(id=keep.id).update(quantity=line['total'])
+        OrderItem.objects.filter(id__in=[i.id for i in extra]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0002_order_user_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_carts, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,116 @@
-from django.db import models
+import hashlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.conf import settings
-from products.models import Product
+from django.utils import timezone
+from products.models import InsufficientStock, Product
+
+
+# a stored Checkout Session is only handed out again if it stays open this long
+CHECKOUT_REUSE_MARGIN = timedelta(minutes=5)
+
+
+class OrderChanged(Exception):
+    """The cart was modified after a Checkout Session was created for it."""
+
+
+def hash_cart(items):
+    """
+    Digest of a cart's lines (product, quantity, unit price), independent of
+    line order, identifying what a Checkout Session charges for.
+    """
+    lines = sorted(f'{item.product_id}:{item.quantity}:{item.price}' for item in items)
+    return hashlib.sha256('|'.join(lines).encode()).hexdigest()
+
+
+def lock_stock(product_ids):
+    """
+    Serialise stock decisions on these products until the transaction ends,
+    with a transaction-level advisory lock per product id. They are taken in
+    id order so overlapping carts can't deadlock, and leave the product rows
+    themselves unlocked for catalog reads and edits.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(id) FROM unnest(%s::bigint[]) AS id", [sorted(product_ids)])
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_items(self):
+        """
+        Prefetch items together with their product, creator and images,
+        so serializing a page of orders costs a fixed number of queries.
+        """
+        return self.prefetch_related(
+            models.Prefetch(
+                'items',
+                queryset=OrderItem.objects
+                .select_related('product__created_by')
+                .prefetch_related('product__images')
+            )
+        )
+
+    def get_or_create_cart(self, user):
+        """
+        Return the user's pending order. The partial unique constraint on
+        (user, PENDING) makes concurrent creates collapse onto one row.
+        """
+        order, _ = self.get_or_create(user=user, status=Order.Status.PENDING)
+        return order
+
+    def bump_version(self, order):
+        # every cart change invalidates Checkout Sessions created for the old contents
+        self.filter(pk=order.pk).update(version=F('version') + 1)
+
+    def record_checkout_session(self, order, session, cart_hash):
+        """
+        Store a Checkout Session created from a snapshot of `order`, unless
+        the cart has changed since. Returns whether the snapshot still held.
+        """
+        return bool(
+            self.filter(pk=order.pk, status=Order.Status.PENDING, version=order.version)
+            .update(
+                stripe_session_id=session.id,
+                stripe_session_url=session.url,
+                stripe_session_expires_at=datetime.fromtimestamp(session.expires_at, tz=dt_timezone.utc),
+                checkout_hash=cart_hash,
+            )
+        )
+
+
+class OrderItemQuerySet(models.QuerySet):
+    def add_quantity(self, order, product, quantity):
+        """
+        Increment a cart line in the database, inserting it if missing.
+        """
+        lines = self.filter(order=order, product=product)
+        changes = {'quantity': F('quantity') + quantity, 'updated_at': timezone.now()}
+        with transaction.atomic():
+            Order.objects.bump_version(order)
+            if lines.update(**changes):
+                return
+            try:
+                with transaction.atomic():
+                    self.create(order=order, product=product, quantity=quantity, price=product.price)
+            except IntegrityError:
+                # a concurrent request inserted the line first
+                lines.update(**changes)
+
+    def reduce_quantity(self, order, product, quantity):
+        """
+        Decrement a cart line in the database, removing it once it reaches zero.
+        """
+        lines = self.filter(order=order, product=product)
+        with transaction.atomic():
+            Order.objects.bump_version(order)
+            updated = lines.filter(quantity__gt=quantity).update(
+                quantity=F('quantity') - quantity, updated_at=timezone.now()
+            )
+            if not updated:
+                lines.filter(quantity__lte=quantity).delete()
+
 
 class Order(models.Model):
     class Status(models.TextChoices):
@@ -18,12 +128,70 @@ class Order(models.Model):
         choices=Status.choices,
         default=Status.PENDING
     )
+    # bumped on every cart change; Checkout Sessions carry the version they were built from
+    version = models.PositiveIntegerField(default=0)
+    # the open Checkout Session for this cart, reused while the cart is unchanged
+    stripe_session_id = models.CharField(max_length=255, blank=True)
+    stripe_session_url = models.TextField(blank=True)
+    stripe_session_expires_at = models.DateTimeField(null=True, blank=True)
+    checkout_hash = models.CharField(max_length=64, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # backs cursor pagination of a user's order history
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_id_idx'),
+        ]
+        constraints = [
+            # a user has at most one cart
+            models.UniqueConstraint(
+                fields=['user'],
+                condition=Q(status='PENDING'),
+                name='unique_pending_order_per_user'
+            ),
+        ]
+
+    def reusable_checkout_url(self, cart_hash):
+        """
+        URL of the stored Checkout Session if it was created for exactly this
+        cart and is not about to expire, else None.
+        """
+        if (
+            self.stripe_session_url
+            and self.checkout_hash == cart_hash
+            and self.stripe_session_expires_at
+            and self.stripe_session_expires_at > timezone.now() + CHECKOUT_REUSE_MARGIN
+        ):
+            return self.stripe_session_url
+        return None
+
     def total_price(self):
+        # served from the prefetch cache when loaded via with_items()
         return sum([item.price * item.quantity for item in self.items.all()])
 
+    def quantities(self):
+        quantities = {}
+        for item in self.items.all():
+            quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+        return quantities
+
+    def decrement_stock(self):
+        """
+        Take this order's quantities out of Product.quantity at fulfilment;
+        raises InsufficientStock. Stock held by other orders' live
+        reservations is off limits, and this order's own reservation is
+        consumed.
+        """
+        with transaction.atomic():
+            quantities = self.quantities()
+            lock_stock(quantities)
+            StockReservation.objects.check_available(quantities, order=self)
+            Product.objects.decrement_stock(quantities)
+            self.reservations.all().delete()
+
     def __str__(self):
         return f"Order {self.id} - {self.user.username} - {self.status}"
 
@@ -45,5 +213,155 @@ class OrderItem(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = OrderItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'], name='unique_order_product'),
+        ]
+
     def __str__(self):
         return f"{self.product.name} x {self.quantity}"
+
+
+class StockReservationQuerySet(models.QuerySet):
+    def live(self):
+        return self.filter(expires_at__gt=timezone.now())
+
+    def held(self, product, exclude_order=None):
+        """
+        Expression for the units of `product` (usually an OuterRef) held by
+        live reservations, not counting those of `exclude_order`.
+        """
+        held = StockReservation.objects.live().filter(product=product)
+        if exclude_order is not None:
+            held = held.exclude(order=exclude_order)
+        return Coalesce(Subquery(held.values('product').annotate(total=Sum('quantity')).values('total')), 0)
+
+    def available(self, product_ids, exclude_order=None):
+        """
+        {product_id: (name, available)} where available is Product.quantity
+        less what live reservations of other orders hold.
+        """
+        return {
+            pk: (name, available)
+            for pk, name, available in Product.objects.filter(id__in=product_ids)
+            .annotate(available=F('quantity') - self.held(OuterRef('pk'), exclude_order))
+            .values_list('id', 'name', 'available')
+        }
+
+    def check_available(self, quantities, order=None):
+        """
+        Raise InsufficientStock, naming every short product, unless
+        {product_id: quantity} fits in the stock `order` may use. Call it
+        under lock_stock() so the answer holds until the transaction ends.
+        """
+        stock = self.available(quantities, exclude_order=order)
+        short = [
+            stock[pk][0] if pk in stock else str(pk)
+            for pk, quantity in quantities.items()
+            if pk not in stock or stock[pk][1] < quantity
+        ]
+        if short:
+            raise InsufficientStock(short)
+
+    def covers(self, order, until):
+        """
+        Whether the order's reservations hold exactly its current quantities
+        until at least `until`.
+        """
+        held = dict(self.filter(order=order, expires_at__gte=until).values_list('product_id', 'quantity'))
+        return held == order.quantities()
+
+    def hold_for_session(self, order, session_expires_at):
+        """
+        Make sure the order's current quantities stay held until its Checkout
+        Session expires, plus STOCK_RESERVATION_GRACE, so the session never
+        outlives its stock. Reserves again unless the existing hold already
+        covers that; raises InsufficientStock.
+        """
+        until = session_expires_at + timedelta(seconds=settings.STOCK_RESERVATION_GRACE)
+        if not self.covers(order, until):
+            self.reserve(order, until)
+
+    def reserve(self, order, expires_at):
+        """
+        Hold the order's current quantities until `expires_at`, replacing any
+        earlier reservation of the same order; raises InsufficientStock
+        without holding anything. Product rows are not written.
+        """
+        with transaction.atomic():
+            quantities = order.quantities()
+            lock_stock(quantities)
+            self.check_available(quantities, order=order)
+            StockReservation.objects.filter(order=order).delete()
+            self.bulk_create([
+                StockReservation(order=order, product_id=pk, quantity=quantity, expires_at=expires_at)
+                for pk, quantity in quantities.items()
+            ])
+
+    def release(self):
+        """
+        Delete the reservations, making their stock available to other
+        carts again. Returns how many were released.
+        """
+        return self.delete()[0]
+
+    def release_abandoned(self, order):
+        """
+        Release the order's hold after a failed checkout, unless its stored
+        Checkout Session is still open for the current cart: a concurrent
+        checkout of the same cart may have handed that session out, and it
+        must keep its stock. The order row is locked so the stored session
+        can't change in between. Returns how many were released.
+        """
+        with transaction.atomic():
+            order = Order.objects.select_for_update().get(pk=order.pk)
+            if order.reusable_checkout_url(hash_cart(order.items.all())):
+                return 0
+            return self.filter(order=order).release()
+
+    def release_expired(self, batch_size=500):
+        """
+        Delete one batch of expired reservations, oldest first. They no
+        longer count against stock, so this only keeps the table small.
+        Rows are claimed with SKIP LOCKED, so a sweep never waits on a
+        checkout that is replacing or consuming its reservation.
+        """
+        with transaction.atomic():
+            # SKIP LOCKED has to apply before the LIMIT, or a batch of locked
+            # rows would come back empty and end the sweep early
+            ids = (
+                self.filter(expires_at__lte=timezone.now())
+                .order_by('expires_at')
+                .select_for_update(skip_locked=True)
+                .values('id')[:batch_size]
+            )
+            return self.filter(id__in=ids).release()
+
+
+class StockReservation(models.Model):
+    """
+    Stock held for a cart between checkout and payment. Product.quantity is
+    left alone: while unexpired, the reservation counts against what other
+    carts can reserve, add or be fulfilled from. Fulfilment consumes it and
+    release_stock_reservations deletes expired ones.
+    """
+    order = models.ForeignKey(Order, related_name="reservations", on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name="reservations", on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = StockReservationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at'], name='reservation_expires_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'], name='unique_reservation_order_product'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} for order {self.order_id}"
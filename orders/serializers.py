@@ -1,19 +1,23 @@
 from rest_framework import serializers
 from .models import Order, OrderItem
-from products.serializers import ProductSerializer  # assuming you already have ProductSerializer
+from products.serializers import ProductSerializer, ProductSummarySerializer
 
 # Serializer for each order item
 class OrderItemSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
-
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.fields['product'].context.update({'request': self.context.get('request')})
+    # compact by default; ?expand=product returns the full product
+    product = ProductSummarySerializer(read_only=True)
 
     class Meta:
         model = OrderItem
         fields = ['id', 'product', 'quantity', 'price', 'created_at', 'updated_at']
 
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is not None and 'product' in request.query_params.get('expand', '').split(','):
+            fields['product'] = ProductSerializer(read_only=True)
+        return fields
+
 
 # Serializer for the order itself
 class OrderSerializer(serializers.ModelSerializer):
@@ -1,3 +1,557 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from payments import gateway
+from products import cache
+from products.models import Product, ProductImage
+from products.tests import LOCAL_STORAGES
+from .models import Order, OrderItem, StockReservation, hash_cart
+
+User = get_user_model()
+
+class MyOrdersPaginationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_orders_are_cursor_paginated_newest_first(self):
+        orders = [
+            Order.objects.create(user=self.user, status=Order.Status.ORDERED)
+            for _ in range(5)
+        ]
+
+        response = self.client.get('/api/orders/orders/', {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [o['id'] for o in response.data['results']],
+            [orders[4].id, orders[3].id]
+        )
+
+        seen = [o['id'] for o in response.data['results']]
+        next_url = response.data['next']
+        while next_url:
+            response = self.client.get(next_url)
+            seen += [o['id'] for o in response.data['results']]
+            next_url = response.data['next']
+
+        self.assertEqual(seen, [o.id for o in reversed(orders)])
+
+
+@override_settings(STORAGES=LOCAL_STORAGES)
+class MyOrdersQueryCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def create_orders(self, count, items_per_order=3):
+        for _ in range(count):
+            order = Order.objects.create(user=self.user, status=Order.Status.ORDERED)
+            for i in range(items_per_order):
+                product = Product.objects.create(name=f'Product {i}', price='4.00', quantity=10)
+                ProductImage.objects.create(
+                    product=product,
+                    image=SimpleUploadedFile('p.jpg', b'img', content_type='image/jpeg')
+                )
+                OrderItem.objects.create(order=order, product=product, quantity=2, price='4.00')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(ctx.captured_queries), response
+
+    def test_order_list_query_count_is_flat(self):
+        self.create_orders(1)
+        small, _ = self.count_queries('/api/orders/orders/')
+
+        self.create_orders(5)
+        large, response = self.count_queries('/api/orders/orders/')
+
+        self.assertEqual(small, large)
+        self.assertEqual(response.data['results'][0]['total_price'], 24)
+
+    def test_order_detail_total_uses_prefetched_items(self):
+        self.create_orders(1, items_per_order=5)
+        order = Order.objects.get()
+
+        queries, response = self.count_queries(f'/api/orders/orders/{order.id}/')
+
+        # validator aggregate, order, items with products, images
+        self.assertEqual(queries, 4)
+        self.assertEqual(response.data['total_price'], 40)
+
+
+@override_settings(STORAGES=LOCAL_STORAGES)
+class CartProductRepresentationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.product = Product.objects.create(
+            name='Mini Car',
+            description='A long description',
+            price='12.50',
+            quantity=10
+        )
+        ProductImage.objects.create(
+            product=self.product,
+            image=SimpleUploadedFile('car.jpg', b'img', content_type='image/jpeg')
+        )
+        order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=order, product=self.product, quantity=1, price='12.50')
+
+    def test_cart_embeds_product_summary(self):
+        response = self.client.get('/api/orders/cart/')
+
+        product = response.data['items'][0]['product']
+        self.assertEqual(set(product), {'id', 'name', 'price', 'thumbnail'})
+        self.assertTrue(product['thumbnail'].endswith('.jpg'))
+
+    def test_expand_product_returns_full_representation(self):
+        response = self.client.get('/api/orders/cart/', {'expand': 'product'})
+
+        product = response.data['items'][0]['product']
+        self.assertEqual(product['description'], 'A long description')
+        self.assertEqual(len(product['images']), 1)
+
+
+class CartMutationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.product = Product.objects.create(name='Mini Car', price='12.50', quantity=10)
+
+    def test_repeated_adds_accumulate_on_one_line(self):
+        for _ in range(3):
+            response = self.client.post('/api/orders/cart/add/', {'product_id': self.product.id, 'quantity': 2})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        order = Order.objects.get(user=self.user, status=Order.Status.PENDING)
+        self.assertEqual(list(order.items.values_list('quantity', flat=True)), [6])
+
+    def test_reduce_removes_line_at_zero(self):
+        self.client.post('/api/orders/cart/add/', {'product_id': self.product.id, 'quantity': 2})
+
+        self.client.post('/api/orders/cart/reduce/', {'product_id': self.product.id, 'quantity': 1})
+        self.assertEqual(OrderItem.objects.get().quantity, 1)
+
+        self.client.post('/api/orders/cart/reduce/', {'product_id': self.product.id, 'quantity': 1})
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_only_one_pending_order_per_user(self):
+        Order.objects.create(user=self.user)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Order.objects.create(user=self.user)
+
+        Order.objects.create(user=self.user, status=Order.Status.ORDERED)
+        self.assertEqual(Order.objects.get_or_create_cart(self.user).status, Order.Status.PENDING)
+
+
+class FinalizeOrderStockTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.car = Product.objects.create(name='Mini Car', price='12.50', quantity=5)
+        self.truck = Product.objects.create(name='Mini Truck', price='20.00', quantity=1)
+        self.order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=self.order, product=self.car, quantity=3, price='12.50')
+        OrderItem.objects.create(order=self.order, product=self.truck, quantity=1, price='20.00')
+
+    def finalize(self):
+        session = SimpleNamespace(
+            id='cs_test', payment_intent='pi_test',
+            metadata={'order_id': self.order.id}, payment_status='paid'
+        )
+        with mock.patch('payments.gateway.retrieve_checkout_session', return_value=session):
+            return self.client.post('/api/orders/finalize-order/', {'session_id': 'cs_test'})
+
+    def test_stock_is_decremented_for_all_lines(self):
+        response = self.finalize()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.car.refresh_from_db()
+        self.truck.refresh_from_db()
+        self.assertEqual((self.car.quantity, self.truck.quantity), (2, 0))
+
+    def test_insufficient_stock_leaves_every_line_untouched(self):
+        Product.objects.filter(id=self.truck.id).update(quantity=0)
+
+        response = self.finalize()
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Mini Truck', response.data['error'])
+        self.car.refresh_from_db()
+        self.assertEqual(self.car.quantity, 5)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.Status.PENDING)
+
+
+class OrderConditionalGetTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.product = Product.objects.create(name='Mini Car', price='12.50', quantity=10)
+        self.client.post('/api/orders/cart/add/', {'product_id': self.product.id, 'quantity': 1})
+
+    def test_unchanged_cart_returns_304(self):
+        etag = self.client.get('/api/orders/cart/')['ETag']
+
+        response = self.client.get('/api/orders/cart/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_cart_change_invalidates_etag(self):
+        etag = self.client.get('/api/orders/cart/')['ETag']
+
+        self.client.post('/api/orders/cart/add/', {'product_id': self.product.id, 'quantity': 1})
+        response = self.client.get('/api/orders/cart/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['items'][0]['quantity'], 2)
+
+    def test_missing_and_empty_cart_have_different_etags(self):
+        Order.objects.filter(user=self.user).delete()
+        etag = self.client.get('/api/orders/cart/')['ETag']
+
+        Order.objects.create(user=self.user)
+        response = self.client.get('/api/orders/cart/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['items'], [])
+
+    def test_order_history_etag_is_per_user(self):
+        etag = self.client.get('/api/orders/orders/')['ETag']
+        self.assertEqual(
+            self.client.get('/api/orders/orders/', HTTP_IF_NONE_MATCH=etag).status_code,
+            status.HTTP_304_NOT_MODIFIED
+        )
+
+        other = User.objects.create_user(username='other', password='testpass123')
+        self.client.force_authenticate(user=other)
+        response = self.client.get('/api/orders/orders/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class CheckoutTestMixin:
+    """
+    A logged-in buyer and a stand-in for gateway.create_checkout_session
+    that returns a new session per call (cs_test_1, cs_test_2, ...).
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.client = self.login(self.user)
+        patcher = mock.patch('payments.gateway.create_checkout_session', side_effect=self.create_session)
+        self.create = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def login(self, user):
+        client = APIClient()
+        client.force_authenticate(user=user)
+        return client
+
+    def create_session(self, **kwargs):
+        session_id = f'cs_test_{self.create.call_count}'
+        self.metadata = kwargs['metadata']
+        return SimpleNamespace(
+            id=session_id, url=f'https://checkout.stripe.test/{session_id}',
+            expires_at=kwargs['expires_at'], metadata=kwargs['metadata']
+        )
+
+    def finalize(self, metadata, client=None):
+        session = SimpleNamespace(id='cs_test', payment_intent='pi_test', metadata=metadata, payment_status='paid')
+        with mock.patch('payments.gateway.retrieve_checkout_session', return_value=session):
+            return (client or self.client).post('/api/orders/finalize-order/', {'session_id': 'cs_test'})
+
+
+class TwoPhaseCheckoutTest(CheckoutTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.car = Product.objects.create(name='Mini Car', price='12.50', quantity=5)
+        self.client.post('/api/orders/cart/add/', {'product_id': self.car.id, 'quantity': 2})
+        self.order = Order.objects.get(user=self.user)
+
+    def checkout(self, during_stripe_call=lambda: None):
+        atomic_depth = len(connection.atomic_blocks)
+
+        def create_session(**kwargs):
+            # only the test case's own transactions may be open here
+            self.assertEqual(len(connection.atomic_blocks), atomic_depth)
+            during_stripe_call()
+            return CheckoutTestMixin.create_session(self, **kwargs)
+
+        self.create.side_effect = create_session
+        return self.client.post('/api/orders/checkout/')
+
+    def test_checkout_records_session_for_the_snapshot(self):
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.stripe_session_id, 'cs_test_1')
+        self.assertEqual(self.metadata['cart_hash'], hash_cart(self.order.items.all()))
+
+    def test_cart_change_during_stripe_call_is_rejected(self):
+        response = self.checkout(
+            lambda: OrderItem.objects.add_quantity(self.order, self.car, 1)
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.stripe_session_id, '')
+        self.car.refresh_from_db()
+        self.assertEqual(self.car.quantity, 5)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_finalize_rejects_session_for_an_older_cart(self):
+        self.checkout()
+        metadata = {k: str(v) for k, v in self.metadata.items()}
+        self.client.post('/api/orders/cart/add/', {'product_id': self.car.id, 'quantity': 1})
+
+        response = self.finalize(metadata)
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.car.refresh_from_db()
+        # the checkout only reserved the stock
+        self.assertEqual(self.car.quantity, 5)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.Status.PENDING)
+
+        metadata['cart_hash'] = hash_cart(self.order.items.all())
+        self.assertEqual(self.finalize(metadata).status_code, status.HTTP_200_OK)
+        self.car.refresh_from_db()
+        self.assertEqual(self.car.quantity, 2)
+
+
+class CheckoutSessionReuseTest(CheckoutTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.car = Product.objects.create(name='Mini Car', price='12.50', quantity=5)
+        self.client.post('/api/orders/cart/add/', {'product_id': self.car.id, 'quantity': 2})
+
+    def checkout(self):
+        response = self.client.post('/api/orders/checkout/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['url']
+
+    def test_unchanged_cart_reuses_open_session(self):
+        first = self.checkout()
+
+        self.assertEqual(self.checkout(), first)
+        self.assertEqual(self.create.call_count, 1)
+
+        # same content after an add and a reduce is still the same cart
+        self.client.post('/api/orders/cart/add/', {'product_id': self.car.id, 'quantity': 1})
+        self.client.post('/api/orders/cart/reduce/', {'product_id': self.car.id, 'quantity': 1})
+        self.assertEqual(self.checkout(), first)
+        self.assertEqual(self.create.call_count, 1)
+
+    def test_changed_cart_gets_new_session(self):
+        first = self.checkout()
+        self.client.post('/api/orders/cart/add/', {'product_id': self.car.id, 'quantity': 1})
+
+        self.assertNotEqual(self.checkout(), first)
+        self.assertEqual(self.create.call_count, 2)
+
+    def test_session_close_to_expiry_is_not_reused(self):
+        first = self.checkout()
+        Order.objects.filter(user=self.user).update(stripe_session_expires_at=timezone.now() + timedelta(minutes=1))
+
+        self.assertNotEqual(self.checkout(), first)
+
+    @override_settings(STOCK_RESERVATION_GRACE=300)
+    def test_stock_is_held_past_the_session_expiry(self):
+        self.checkout()
+        order = Order.objects.get(user=self.user)
+
+        self.assertEqual(
+            StockReservation.objects.get().expires_at,
+            order.stripe_session_expires_at + timedelta(seconds=300)
+        )
+
+    def test_reused_session_gets_its_hold_back(self):
+        first = self.checkout()
+        StockReservation.objects.all().release()
+
+        self.assertEqual(self.checkout(), first)
+        self.assertEqual(StockReservation.objects.get().quantity, 2)
+
+    def test_reused_session_is_refused_once_its_stock_is_gone(self):
+        self.checkout()
+        StockReservation.objects.all().release()
+        Product.objects.filter(pk=self.car.pk).update(quantity=1)
+
+        response = self.client.post('/api/orders/checkout/')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_failed_checkout_keeps_the_hold_of_a_concurrent_session(self):
+        order = Order.objects.get(user=self.user)
+
+        def create_session(**kwargs):
+            # a double-click records its session for the same cart meanwhile
+            session = CheckoutTestMixin.create_session(self, **kwargs)
+            self.assertTrue(Order.objects.record_checkout_session(order, session, kwargs['metadata']['cart_hash']))
+            raise gateway.StripeUnavailable("Stripe circuit breaker is open")
+
+        self.create.side_effect = create_session
+        response = self.client.post('/api/orders/checkout/')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(StockReservation.objects.get().quantity, 2)
+        # the other request's session is handed out with that hold behind it
+        self.create.side_effect = self.create_session
+        self.assertEqual(self.checkout(), 'https://checkout.stripe.test/cs_test_1')
+        self.assertEqual(self.create.call_count, 1)
+
+    def test_payments_endpoint_shares_the_stored_session(self):
+        first = self.checkout()
+        order = Order.objects.get(user=self.user)
+
+        response = self.client.post('/api/payments/create-checkout-session/', {'order_id': order.id})
+
+        self.assertEqual(response.data['url'], first)
+        self.assertEqual(self.create.call_count, 1)
+
+
+class CheckoutStockValidationTest(CheckoutTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.order = Order.objects.create(user=self.user)
+
+    def fill_cart(self, lines):
+        for i in range(lines):
+            product = Product.objects.create(name=f'Car {i}', price='10.00', quantity=5)
+            OrderItem.objects.create(order=self.order, product=product, quantity=2, price='10.00')
+
+    def checkout_queries(self):
+        # start from an unreserved cart so both runs do the same work
+        StockReservation.objects.all().release()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/orders/checkout/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries), self.create.call_args.kwargs['line_items']
+
+    def test_query_count_does_not_grow_with_cart_lines(self):
+        self.fill_cart(2)
+        small, _ = self.checkout_queries()
+
+        self.fill_cart(30)
+        large, line_items = self.checkout_queries()
+
+        self.assertEqual(large, small)
+        self.assertEqual(len(line_items), 32)
+        self.assertEqual(line_items[0]['price_data']['product_data']['name'], 'Car 0')
+
+    def test_all_short_lines_are_reported_together(self):
+        self.fill_cart(3)
+        Product.objects.filter(name__in=['Car 0', 'Car 2']).update(quantity=1)
+
+        response = self.client.post('/api/orders/checkout/')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error'], 'Not enough stock for Car 0, Car 2')
+
+
+class StockReservationTest(CheckoutTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.car = Product.objects.create(name='Mini Car', price='12.50', quantity=3)
+        self.buyers = [self.client, self.login(User.objects.create_user(username='second', password='testpass123'))]
+        for buyer in self.buyers:
+            buyer.post('/api/orders/cart/add/', {'product_id': self.car.id, 'quantity': 2})
+
+    def stock(self):
+        self.car.refresh_from_db()
+        return self.car.quantity
+
+    def available(self):
+        return StockReservation.objects.available([self.car.id])[self.car.id][1]
+
+    def test_checkout_holds_stock_so_a_later_checkout_fails_before_paying(self):
+        self.assertEqual(self.buyers[0].post('/api/orders/checkout/').status_code, status.HTTP_200_OK)
+        self.assertEqual((self.stock(), self.available()), (3, 1))
+
+        response = self.buyers[1].post('/api/orders/checkout/')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Mini Car', response.data['error'])
+        self.assertEqual(self.create.call_count, 1)
+
+    def test_repeated_checkout_does_not_reserve_twice(self):
+        for _ in range(2):
+            self.buyers[0].post('/api/orders/checkout/')
+        self.assertEqual(self.available(), 1)
+        self.assertEqual(StockReservation.objects.get().quantity, 2)
+
+    def test_checkout_writes_no_product_rows(self):
+        self.car.refresh_from_db()
+        version = cache.get_version()
+
+        self.buyers[0].post('/api/orders/checkout/')
+
+        self.assertEqual(Product.objects.get(pk=self.car.pk).updated_at, self.car.updated_at)
+        self.assertEqual(cache.get_version(), version)
+
+    def test_held_stock_cannot_be_added_to_another_cart(self):
+        self.buyers[0].post('/api/orders/checkout/')
+        shopper = self.login(User.objects.create_user(username='third', password='testpass123'))
+
+        response = shopper.post('/api/orders/cart/add/', {'product_id': self.car.id, 'quantity': 2})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_fulfilment_consumes_the_reservation(self):
+        self.buyers[0].post('/api/orders/checkout/')
+
+        response = self.finalize(self.metadata)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((self.stock(), self.available()), (1, 1))
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_fulfilment_cannot_take_stock_held_for_another_order(self):
+        self.buyers[0].post('/api/orders/checkout/')
+        order = Order.objects.get(user__username='second')
+
+        response = self.finalize({'order_id': str(order.id)}, self.buyers[1])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual((self.stock(), self.available()), (3, 1))
+
+    def test_sweeper_releases_only_expired_reservations(self):
+        self.car.quantity = 4
+        self.car.save()
+        for buyer in self.buyers:
+            buyer.post('/api/orders/checkout/')
+        self.assertEqual(self.available(), 0)
+        expired = StockReservation.objects.order_by('id').first()
+        StockReservation.objects.filter(pk=expired.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        # an expired hold stops counting before the sweeper gets to it
+        self.assertEqual(self.available(), 2)
+
+        out = StringIO()
+        call_command('release_stock_reservations', '--batch-size', '1', stdout=out)
+
+        self.assertIn('Released 1 expired stock reservations', out.getvalue())
+        self.assertEqual((self.stock(), self.available()), (4, 2))
+        self.assertEqual(list(StockReservation.objects.values_list('order__user__username', flat=True)), ['second'])
@@ -1,14 +1,21 @@
+from datetime import timedelta
+
 import stripe
 from django.db import transaction
+from django.db.models import F, OuterRef
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.generics import ListAPIView, RetrieveAPIView
 from backend import settings
-from products.models import Product
-from .models import Order, OrderItem
+from backend.conditional import ConditionalGetMixin
+from payments import gateway
+from payments.fulfilment import fulfil_checkout_session
+from products.models import InsufficientStock, Product
+from .models import Order, OrderChanged, OrderItem, StockReservation, hash_cart
 from .serializers import OrderSerializer
 
 class AddToCartView(APIView):
@@ -19,24 +26,20 @@ class AddToCartView(APIView):
         product_id = request.data.get("product_id")
         quantity = int(request.data.get("quantity", 1))
 
-        if quantity < 0:
+        if quantity <= 0:
             return Response({"error": "Quantity must be greater than zero"}, status=status.HTTP_400_BAD_REQUEST)
 
-        product = get_object_or_404(Product, id=product_id, is_active=True)
+        # stock held by open checkouts isn't available to add
+        product = get_object_or_404(
+            Product.active.annotate(available=F('quantity') - StockReservation.objects.held(OuterRef('pk'))),
+            id=product_id
+        )
 
-        if product.quantity < quantity:
+        if product.available < quantity:
             return Response({"error": "Not enough stock available"}, status=status.HTTP_400_BAD_REQUEST)
 
-        order, _ = Order.objects.get_or_create(user=user, status=Order.Status.PENDING)
-
-        item, created = OrderItem.objects.get_or_create(
-            order=order,
-            product=product,
-            defaults={"quantity": quantity, "price": product.price}
-        )
-        if not created:
-            item.quantity += quantity
-            item.save()
+        order = Order.objects.get_or_create_cart(user)
+        OrderItem.objects.add_quantity(order, product, quantity)
 
         return Response({"message": "Product added to cart"}, status=status.HTTP_200_OK)
 
@@ -51,29 +54,29 @@ class ReduceFromCartView(APIView):
         if quantity <= 0:
             return Response({"error": "Quantity must be greater than zero"}, status=status.HTTP_400_BAD_REQUEST)
 
-        product = get_object_or_404(Product, id=product_id, is_active=True)
+        product = get_object_or_404(Product.active, id=product_id)
 
         if product.quantity < quantity:
             return Response({"error": "Not enough stock available"}, status=status.HTTP_400_BAD_REQUEST)
 
-        order, _ = Order.objects.get_or_create(user=user, status=Order.Status.PENDING)
-
-        item, created = OrderItem.objects.get_or_create(
-            order=order,
-            product=product,
-            defaults={"quantity": quantity, "price": product.price}
-        )
-        if not created:
-            item.quantity -= quantity
-            item.save()
+        order = Order.objects.get_or_create_cart(user)
+        OrderItem.objects.reduce_quantity(order, product, quantity)
 
         return Response({"message": "Product reduced from cart"}, status=status.HTTP_200_OK)
 
-class CartView(APIView):
+class CartView(ConditionalGetMixin, APIView):
     permission_classes = [IsAuthenticated]
+    validator_fields = ('updated_at', 'items__updated_at', 'items__product__updated_at')
+
+    def get_validator_queryset(self, request, *args, **kwargs):
+        # validated on the order itself, so "no cart" and "empty cart" differ
+        return Order.objects.filter(user=request.user, status=Order.Status.PENDING)
 
     def get(self, request):
-        order = Order.objects.filter(user=request.user, status=Order.Status.PENDING).first()
+        return self.conditional_get(self.get_cart, request)
+
+    def get_cart(self, request):
+        order = Order.objects.with_items().filter(user=request.user, status=Order.Status.PENDING).first()
         if not order:
             return Response({"message": "Cart is empty"}, status=status.HTTP_200_OK)
         serializer = OrderSerializer(order, context={'request': request})
@@ -83,20 +86,46 @@ class CartView(APIView):
 class CreateCheckoutSessionView(APIView):
     permission_classes = [IsAuthenticated]
 
-    @transaction.atomic
     def post(self, request):
-        order = Order.objects.filter(user=request.user, status=Order.Status.PENDING).select_for_update().first()
-        if not order or not order.items.exists():
+        # Snapshot the cart without locks; the version read first guards everything after it
+        order = Order.objects.filter(user=request.user, status=Order.Status.PENDING).first()
+        # lines, their products and the stock other carts hold in one query;
+        # everything below works off this list
+        items = list(
+            order.items.select_related('product')
+            .annotate(available=F('product__quantity') - StockReservation.objects.held(OuterRef('product'), order))
+            .order_by('id')
+        ) if order else []
+        if not items:
             return Response({"error": "No items in cart"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Check stock
-        for item in order.items.all():
-            if item.product.quantity < item.quantity:
-                return Response({"error": f"Not enough stock for {item.product.name}"}, status=status.HTTP_400_BAD_REQUEST)
+        # Check stock, reporting every short line at once
+        short = [item.product.name for item in items if item.available < item.quantity]
+        if short:
+            return Response({"error": str(InsufficientStock(short))}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Hand out the existing session again while the cart is unchanged
+        cart_hash = hash_cart(items)
+        url = order.reusable_checkout_url(cart_hash)
+        if url:
+            session_expires_at = order.stripe_session_expires_at
+        else:
+            # whole seconds, as Stripe stores it
+            now = timezone.now().replace(microsecond=0)
+            session_expires_at = now + timedelta(seconds=settings.STRIPE_CHECKOUT_SESSION_TTL)
+
+        # Hold the stock for as long as the session can be paid; a reused
+        # session gets its hold back if it was released meanwhile
+        try:
+            StockReservation.objects.hold_for_session(order, session_expires_at)
+        except InsufficientStock as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if url:
+            return Response({"url": url})
 
         # Build line items for Stripe
         line_items = []
-        for item in order.items.all():
+        for item in items:
             price = int(item.price * 100)  # Stripe uses cents
             line_items.append({
                 'price_data': {
@@ -107,43 +136,50 @@ class CreateCheckoutSessionView(APIView):
                 'quantity': item.quantity,
             })
 
-        session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=line_items,
-            mode='payment',
-            success_url=f"{settings.FRONTEND_URL}/payment-success?session_id={{CHECKOUT_SESSION_ID}}",
-            cancel_url=f"{settings.FRONTEND_URL}/cart",
-            metadata={'order_id': order.id}
-        )
+        # No transaction is open while waiting on Stripe
+        try:
+            session = gateway.create_checkout_session(
+                payment_method_types=['card'],
+                line_items=line_items,
+                mode='payment',
+                success_url=f"{settings.FRONTEND_URL}/payment-success?session_id={{CHECKOUT_SESSION_ID}}",
+                cancel_url=f"{settings.FRONTEND_URL}/cart",
+                expires_at=int(session_expires_at.timestamp()),
+                metadata={'order_id': order.id, 'cart_hash': cart_hash}
+            )
+        except stripe.error.StripeError as e:
+            StockReservation.objects.release_abandoned(order)
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not Order.objects.record_checkout_session(order, session, cart_hash):
+            StockReservation.objects.release_abandoned(order)
+            return Response({"error": "Cart changed during checkout, please try again"}, status=status.HTTP_409_CONFLICT)
 
         return Response({"url": session.url})
 class FinalizeOrderView(APIView):
     permission_classes = [IsAuthenticated]
 
-    @transaction.atomic
     def post(self, request):
         session_id = request.data.get("session_id")
         if not session_id:
             return Response({"error": "session_id is required"}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            session = stripe.checkout.Session.retrieve(session_id)
+            # Stripe is called before any transaction; fulfilment opens its own short one
+            session = gateway.retrieve_checkout_session(session_id)
             order_id = session.metadata.get("order_id")
-            order = Order.objects.select_for_update().get(id=order_id, user=request.user)
+            order = Order.objects.get(id=order_id, user=request.user)
 
             if session.payment_status != 'paid':
                 return Response({"error": "Payment not completed"}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Reduce stock
-            for item in order.items.all():
-                product = item.product
-                if product.quantity < item.quantity:
-                    return Response({"error": f"Not enough stock for {product.name}"}, status=status.HTTP_400_BAD_REQUEST)
-                product.quantity -= item.quantity
-                product.save()
-
-            order.status = Order.Status.ORDERED
-            order.save()
+            # Reduce stock and mark ordered, once per session
+            try:
+                fulfil_checkout_session(order.id, session.id, session.payment_intent, session.metadata.get("cart_hash"))
+            except InsufficientStock as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            except OrderChanged:
+                return Response({"error": "Cart changed after checkout"}, status=status.HTTP_409_CONFLICT)
 
             return Response({"message": "Order finalized successfully", "order_id": order.id})
 
@@ -169,25 +205,41 @@ class RemoveFromCartView(APIView):
             return Response({"error": "Item not found in cart"}, status=status.HTTP_404_NOT_FOUND)
 
         # Delete the item
-        item.delete()
+        with transaction.atomic():
+            item.delete()
+            Order.objects.bump_version(order)
         return Response({"message": "Item removed from cart"}, status=status.HTTP_200_OK)
 
 
 # --- ORDER LIST / DETAILS ---
 
-class MyOrdersView(ListAPIView):
+class MyOrdersView(ConditionalGetMixin, ListAPIView):
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    validator_fields = ('updated_at', 'items__updated_at', 'items__product__updated_at')
+
+    def get_validator_queryset(self, request, *args, **kwargs):
+        return Order.objects.filter(user=request.user)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_get(super().list, request, *args, **kwargs)
 
     def get_queryset(self):
-        # Return only the logged-in user's orders, newest first
-        return Order.objects.filter(user=self.request.user).order_by('-id')
+        # Return only the logged-in user's orders; the cursor paginator orders them newest first
+        return Order.objects.with_items().filter(user=self.request.user)
 
 
-class OrderDetailView(RetrieveAPIView):
+class OrderDetailView(ConditionalGetMixin, RetrieveAPIView):
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    validator_fields = ('updated_at', 'items__updated_at', 'items__product__updated_at')
+
+    def get_validator_queryset(self, request, *args, **kwargs):
+        return Order.objects.filter(user=request.user, pk=kwargs['pk'])
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_get(super().retrieve, request, *args, **kwargs)
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
+        return Order.objects.with_items().filter(user=self.request.user)
 
@@ -0,0 +1,139 @@
+"""
+A local stand-in for the parts of the Stripe API the shop uses, for tests.
+
+Point the gateway at it with override_settings(STRIPE_API_BASE=server.url).
+It supports Checkout Session create/retrieve and refund create, replays
+responses for repeated idempotency keys like Stripe does, and can inject
+failures (`fail_next`) and slow responses (`delay`).
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from urllib.parse import parse_qsl
+
+
+def unflatten(pairs):
+    """Turn Stripe's form encoding (a[b][0][c]=1) back into nested dicts."""
+    data = {}
+    for key, value in pairs:
+        parts = re.findall(r'[^\[\]]+', key)
+        node = data
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return data
+
+
+class FakeStripeServer:
+    def __init__(self):
+        self.sessions = {}
+        self.refunds = {}
+        self.requests = []
+        self.replies = {}
+        self.failures = []
+        self.delay = 0
+        self.ids = count(1)
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fail_next(self, times=1, status=500):
+        self.failures.extend([status] * times)
+
+    def pay(self, session_id, payment_intent='pi_fake'):
+        self.sessions[session_id].update(payment_status='paid', status='complete', payment_intent=payment_intent)
+
+    def handle(self, method, path, body, headers):
+        with self.lock:
+            self.requests.append((method, path, headers.get('Idempotency-Key')))
+            if self.failures:
+                status = self.failures.pop(0)
+                return status, {'error': {'type': 'api_error', 'message': 'Injected failure'}}
+
+            key = headers.get('Idempotency-Key') if method == 'POST' else None
+            if key in self.replies:
+                return self.replies[key]
+            reply = self.route(method, path, unflatten(parse_qsl(body)))
+            if key:
+                self.replies[key] = reply
+            return reply
+
+    def route(self, method, path, params):
+        if method == 'POST' and path == '/v1/checkout/sessions':
+            session_id = f'cs_test_fake{next(self.ids)}'
+            lines = params.get('line_items', {}).values()
+            self.sessions[session_id] = {
+                'id': session_id,
+                'object': 'checkout.session',
+                'url': f'{self.url}/pay/{session_id}',
+                'status': 'open',
+                'payment_status': 'unpaid',
+                'payment_intent': None,
+                'amount_total': sum(
+                    int(line['price_data']['unit_amount']) * int(line['quantity']) for line in lines
+                ),
+                'metadata': params.get('metadata', {}),
+                'expires_at': int(params.get('expires_at') or time.time() + 24 * 3600),
+            }
+            return 200, self.sessions[session_id]
+
+        match = re.fullmatch(r'/v1/checkout/sessions/([^/]+)', path)
+        if method == 'GET' and match:
+            if match[1] not in self.sessions:
+                return 404, {'error': {'type': 'invalid_request_error', 'message': f'No such checkout.session: {match[1]}'}}
+            return 200, self.sessions[match[1]]
+
+        if method == 'POST' and path == '/v1/refunds':
+            refund_id = f're_fake{next(self.ids)}'
+            self.refunds[refund_id] = {
+                'id': refund_id,
+                'object': 'refund',
+                'status': 'succeeded',
+                'amount': int(params['amount']),
+                'payment_intent': params.get('payment_intent'),
+                'metadata': params.get('metadata', {}),
+            }
+            return 200, self.refunds[refund_id]
+
+        return 404, {'error': {'type': 'invalid_request_error', 'message': f'Unrecognized request URL ({method}: {path})'}}
+
+    def handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def respond(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length).decode()
+                if fake.delay:
+                    time.sleep(fake.delay)
+                status, payload = fake.handle(self.command, self.path.split('?')[0], body, self.headers)
+                data = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # the client gave up waiting, e.g. in timeout tests
+                    pass
+
+            do_GET = do_POST = respond
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,43 @@
+from django.db import transaction
+
+from orders.models import Order, OrderChanged, hash_cart
+from payments.models import Payment, ProcessedStripeEvent
+
+
+def fulfil_checkout_session(order_id, session_id, payment_intent_id, cart_hash=None):
+    """
+    Apply a paid Checkout Session to its order exactly once: reduce stock,
+    mark the order ORDERED and record the Payment.
+
+    The webhook worker and both finalize endpoints all call this; whichever
+    runs first does the work and later calls return False after a single
+    ledger lookup. Raises Order.DoesNotExist, InsufficientStock and, when the
+    cart no longer matches the `cart_hash` the session was created for,
+    OrderChanged; in those cases nothing (including the ledger entry) is written.
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(id=order_id)
+        _, created = ProcessedStripeEvent.objects.get_or_create(
+            key=session_id,
+            defaults={'order': order}
+        )
+        if not created or order.status != Order.Status.PENDING:
+            return False
+        if cart_hash is not None and hash_cart(order.items.all()) != cart_hash:
+            raise OrderChanged(f"Order {order.id} changed after checkout")
+
+        order.decrement_stock()
+        order.status = Order.Status.ORDERED
+        order.save()
+
+        Payment.objects.update_or_create(
+            order=order,
+            defaults={
+                'amount': order.total_price(),
+                'payment_method': Payment.PaymentMethod.CARD,
+                'stripe_payment_intent_id': payment_intent_id,
+                'stripe_session_id': session_id,
+                'status': Payment.Status.SUCCEEDED,
+            }
+        )
+    return True
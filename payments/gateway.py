@@ -0,0 +1,199 @@
+"""
+Single entry point for outbound Stripe API calls.
+
+Each worker process keeps one StripeClient whose HTTP client holds a
+keep-alive connection pool per thread. Calls are bounded by connect/read
+timeouts, retried a bounded number of times with jittered backoff (using
+one idempotency key, so retried POSTs are never applied twice), and fail
+fast through a circuit breaker while Stripe is unreachable.
+"""
+import logging
+import random
+import threading
+import time
+import uuid
+from functools import lru_cache
+
+import stripe
+from django.conf import settings
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+
+logger = logging.getLogger(__name__)
+
+# network failures, timeouts, rate limits and 5xx responses; card and
+# request errors are the caller's problem and are neither retried nor counted
+TRANSIENT_ERRORS = (stripe.error.APIConnectionError, stripe.error.RateLimitError, stripe.error.APIError)
+
+
+class StripeUnavailable(stripe.error.APIConnectionError):
+    """Raised without calling Stripe while the circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive transient failures. Once `reset`
+    seconds have passed a single trial call is let through (half-open);
+    its outcome closes the circuit or opens it for another period.
+    """
+
+    def __init__(self, failures, reset):
+        self.failures = failures
+        self.reset = reset
+        self.consecutive = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset:
+            return 'half-open'
+        return 'open'
+
+    def before_call(self):
+        with self.lock:
+            state = self.state
+            if state == 'open' or (state == 'half-open' and self.trial_running):
+                raise StripeUnavailable("Stripe circuit breaker is open")
+            if state == 'half-open':
+                self.trial_running = True
+
+    def record_success(self):
+        with self.lock:
+            self.consecutive = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive += 1
+            if self.trial_running or self.consecutive >= self.failures:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+class Metrics:
+    """In-process call counts and latencies per operation."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = {}
+
+    def record(self, operation, seconds, outcome, retries):
+        with self.lock:
+            stats = self.operations.setdefault(operation, {
+                'calls': 0, 'errors': 0, 'rejected': 0, 'retries': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+            })
+            stats['calls'] += 1
+            stats['retries'] += retries
+            if outcome == 'rejected':
+                stats['rejected'] += 1
+            elif outcome != 'ok':
+                stats['errors'] += 1
+            ms = seconds * 1000
+            stats['total_ms'] += ms
+            stats['max_ms'] = max(stats['max_ms'], ms)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                operation: {**stats, 'avg_ms': stats['total_ms'] / stats['calls']}
+                for operation, stats in self.operations.items()
+            }
+
+
+@lru_cache(maxsize=None)
+def get_client():
+    http_client = stripe.RequestsClient(
+        timeout=(settings.STRIPE_CONNECT_TIMEOUT, settings.STRIPE_READ_TIMEOUT)
+    )
+    return stripe.StripeClient(
+        settings.STRIPE_SECRET_KEY,
+        base_addresses={'api': settings.STRIPE_API_BASE},
+        # retries are handled in call() so they share the breaker and metrics
+        max_network_retries=0,
+        http_client=http_client,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_breaker():
+    return CircuitBreaker(settings.STRIPE_CIRCUIT_FAILURES, settings.STRIPE_CIRCUIT_RESET)
+
+
+metrics = Metrics()
+
+
+@receiver(setting_changed)
+def reset_client(setting, **kwargs):
+    if setting.startswith('STRIPE_'):
+        get_client.cache_clear()
+        get_breaker.cache_clear()
+
+
+def backoff(attempt):
+    # "full jitter": a random delay up to the exponential cap
+    return random.uniform(0, settings.STRIPE_RETRY_BASE_DELAY * 2 ** attempt)
+
+
+def call(operation, method, *args, idempotent=False, **kwargs):
+    """
+    Run a StripeClient service method under the retry policy, breaker and
+    metrics. `idempotent` POSTs get one idempotency key shared by all their
+    attempts; GETs are safe to retry without one.
+    """
+    breaker = get_breaker()
+    try:
+        breaker.before_call()
+    except StripeUnavailable:
+        metrics.record(operation, 0, 'rejected', 0)
+        raise
+
+    options = {'idempotency_key': str(uuid.uuid4())} if idempotent else {}
+    started = time.monotonic()
+    retries = 0
+    while True:
+        try:
+            result = method(*args, options=options, **kwargs)
+        except TRANSIENT_ERRORS as e:
+            if retries < settings.STRIPE_MAX_RETRIES:
+                retries += 1
+                logger.warning("stripe %s failed (%s), retry %d", operation, e, retries)
+                time.sleep(backoff(retries))
+                continue
+            breaker.record_failure()
+            record(operation, started, type(e).__name__, retries)
+            raise
+        except stripe.error.StripeError as e:
+            # Stripe answered, so the service itself is healthy
+            breaker.record_success()
+            record(operation, started, type(e).__name__, retries)
+            raise
+        except Exception as e:
+            breaker.record_failure()
+            record(operation, started, type(e).__name__, retries)
+            raise
+        breaker.record_success()
+        record(operation, started, 'ok', retries)
+        return result
+
+
+def record(operation, started, outcome, retries):
+    elapsed = time.monotonic() - started
+    metrics.record(operation, elapsed, outcome, retries)
+    logger.info("stripe %s %s in %.0fms (%d retries)", operation, outcome, elapsed * 1000, retries)
+
+
+def create_checkout_session(**params):
+    return call('checkout.sessions.create', get_client().v1.checkout.sessions.create, params, idempotent=True)
+
+
+def retrieve_checkout_session(session_id):
+    return call('checkout.sessions.retrieve', get_client().v1.checkout.sessions.retrieve, session_id)
+
+
+def create_refund(**params):
+    return call('refunds.create', get_client().v1.refunds.create, params, idempotent=True)
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payments.webhooks import process_pending_events
+
+
+class Command(BaseCommand):
+    help = "Drain the Stripe webhook inbox in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument(
+            '--forever',
+            action='store_true',
+            help="Keep polling for new events instead of exiting once the inbox is empty"
+        )
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds to sleep when no events are due")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            picked_up, processed = process_pending_events(options['batch_size'])
+            total += processed
+            # failed events are backed off, so the next batch won't pick them up again
+            if picked_up:
+                continue
+            if not options['forever']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {total} webhook events"))
@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from orders.models import Order
 
 
@@ -95,3 +96,65 @@ class Refund(models.Model):
 
     def __str__(self):
         return f"Refund {self.id} - Payment {self.payment.id} - {self.status}"
+
+
+class WebhookEvent(models.Model):
+    """
+    Inbox of verified Stripe webhook events, drained by the
+    process_webhook_events management command.
+    """
+    class Status(models.TextChoices):
+        PENDING = "PENDING", "Pending"
+        PROCESSED = "PROCESSED", "Processed"
+        FAILED = "FAILED", "Failed"
+
+    stripe_event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(
+        max_length=20,
+        choices=Status.choices,
+        default=Status.PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(
+        null=True,
+        blank=True
+    )
+    # a failed event is retried no earlier than this
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        indexes = [
+            # the worker only ever scans pending events, oldest first
+            models.Index(
+                fields=['created_at'],
+                condition=models.Q(status='PENDING'),
+                name='webhook_event_pending_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"WebhookEvent {self.stripe_event_id} - {self.type} - {self.status}"
+
+
+class ProcessedStripeEvent(models.Model):
+    """
+    Ledger of Stripe objects (checkout sessions) already applied to an order.
+    The unique key turns a replay into a single index lookup.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.CASCADE,
+        related_name="processed_stripe_events"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"ProcessedStripeEvent {self.key} - Order {self.order_id}"
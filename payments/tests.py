@@ -1,10 +1,24 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+import time
+from io import StringIO
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+import stripe
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from rest_framework import status
 from products.models import Product
 from orders.models import Order, OrderItem
-from payments.models import Payment
+from payments import gateway
+from payments.fake_stripe import FakeStripeServer
+from payments.models import Payment, ProcessedStripeEvent, WebhookEvent
 
 User = get_user_model()
 
@@ -115,3 +129,240 @@ class PaymentIntegrationTest(TestCase):
         self.order.refresh_from_db()
         # Note: This would be updated by webhook or payment confirmation
         self.assertEqual(self.order.status, Order.Status.PENDING)
+
+
+FIXTURES_DIR = Path(__file__).resolve().parent / 'fixtures' / 'stripe_events'
+WEBHOOK_SECRET = 'whsec_test_secret'
+
+
+def load_event(name, **metadata):
+    """Load a recorded Stripe event, overriding its session metadata"""
+    event = json.loads((FIXTURES_DIR / f'{name}.json').read_text())
+    event['data']['object']['metadata'].update(metadata)
+    return event
+
+
+def signature_header(payload, secret=WEBHOOK_SECRET):
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET)
+class WebhookInboxTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.product = Product.objects.create(name='Test Product', price=10.00, quantity=100)
+        self.order = Order.objects.create(user=self.user, status=Order.Status.PENDING)
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=2, price=10.00)
+        self.client = APIClient()
+
+    def post_event(self, event):
+        payload = json.dumps(event)
+        return self.client.generic(
+            'POST', '/api/payments/webhook/', payload,
+            content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=signature_header(payload)
+        )
+
+    def test_webhook_only_persists_the_event(self):
+        event = load_event('checkout.session.completed', order_id=str(self.order.id))
+
+        response = self.post_event(event)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        inbox = WebhookEvent.objects.get()
+        self.assertEqual(inbox.stripe_event_id, event['id'])
+        self.assertEqual(inbox.status, WebhookEvent.Status.PENDING)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.Status.PENDING)
+
+    def test_redelivered_event_is_stored_once(self):
+        event = load_event('checkout.session.completed', order_id=str(self.order.id))
+
+        self.post_event(event)
+        self.post_event(event)
+
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+    def test_invalid_signature_is_rejected(self):
+        payload = json.dumps(load_event('checkout.session.completed'))
+        response = self.client.generic(
+            'POST', '/api/payments/webhook/', payload,
+            content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=signature_header(payload, secret='whsec_wrong')
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_worker_applies_pending_events(self):
+        self.post_event(load_event('checkout.session.completed', order_id=str(self.order.id)))
+
+        call_command('process_webhook_events', stdout=StringIO())
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.Status.ORDERED)
+        self.assertEqual(self.order.payment.amount, 20)
+        self.assertEqual(WebhookEvent.objects.get().status, WebhookEvent.Status.PROCESSED)
+
+    def test_failed_event_is_backed_off_not_retried_in_the_same_pass(self):
+        self.post_event(load_event('checkout.session.completed', order_id=str(self.order.id)))
+        stdout = StringIO()
+
+        with mock.patch('payments.webhooks.handle_event', side_effect=RuntimeError('boom')) as handle:
+            call_command('process_webhook_events', stdout=stdout)
+
+        self.assertEqual(handle.call_count, 1)
+        self.assertIn('Processed 0 webhook events', stdout.getvalue())
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts, event.last_error), (WebhookEvent.Status.PENDING, 1, 'boom'))
+        self.assertGreater(event.next_attempt_at, event.created_at)
+
+        # once it is due again, it goes through
+        WebhookEvent.objects.update(next_attempt_at=event.created_at)
+        call_command('process_webhook_events', stdout=StringIO())
+        self.assertEqual(WebhookEvent.objects.get().status, WebhookEvent.Status.PROCESSED)
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET)
+class IdempotentFulfilmentTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.product = Product.objects.create(name='Test Product', price=10.00, quantity=100)
+        self.order = Order.objects.create(user=self.user, status=Order.Status.PENDING)
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=2, price=10.00)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.session = SimpleNamespace(
+            id='cs_test_a1fixtureSession',
+            payment_intent='pi_3QfixturePaymentIntent',
+            payment_status='paid',
+            metadata={'order_id': str(self.order.id)}
+        )
+
+    def finalize(self, url):
+        with mock.patch('payments.gateway.retrieve_checkout_session', return_value=self.session):
+            return self.client.post(url, {'session_id': self.session.id})
+
+    def assert_applied_once(self):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 98)
+        self.assertEqual(ProcessedStripeEvent.objects.filter(key=self.session.id).count(), 1)
+        payment = Payment.objects.get(order=self.order)
+        self.assertEqual(payment.stripe_session_id, self.session.id)
+        self.assertEqual(payment.status, Payment.Status.SUCCEEDED)
+
+    def test_repeated_finalize_is_applied_once(self):
+        for url in ('/api/payments/finalize-order/', '/api/payments/finalize-order/', '/api/orders/finalize-order/'):
+            response = self.finalize(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assert_applied_once()
+
+    def test_webhook_after_finalize_is_a_no_op(self):
+        self.finalize('/api/orders/finalize-order/')
+
+        payload = json.dumps(load_event('checkout.session.completed', order_id=str(self.order.id)))
+        self.client.generic(
+            'POST', '/api/payments/webhook/', payload,
+            content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=signature_header(payload)
+        )
+        payment_updated_at = Payment.objects.get(order=self.order).updated_at
+        call_command('process_webhook_events', stdout=StringIO())
+
+        self.assert_applied_once()
+        self.assertEqual(Payment.objects.get(order=self.order).updated_at, payment_updated_at)
+        self.assertEqual(WebhookEvent.objects.get().status, WebhookEvent.Status.PROCESSED)
+
+
+@override_settings(STRIPE_MAX_RETRIES=2, STRIPE_RETRY_BASE_DELAY=0, STRIPE_CIRCUIT_FAILURES=2)
+class StripeGatewayTest(TestCase):
+    def setUp(self):
+        self.stripe = FakeStripeServer().__enter__()
+        self.addCleanup(self.stripe.__exit__)
+        override = override_settings(STRIPE_API_BASE=self.stripe.url, STRIPE_READ_TIMEOUT=0.5)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def create_session(self):
+        return gateway.create_checkout_session(
+            mode='payment',
+            line_items=[{'price_data': {'currency': 'usd', 'unit_amount': 1250}, 'quantity': 2}],
+            metadata={'order_id': 7},
+        )
+
+    def test_checkout_round_trip_through_fake_server(self):
+        session = self.create_session()
+        self.stripe.pay(session.id)
+
+        retrieved = gateway.retrieve_checkout_session(session.id)
+
+        self.assertEqual(retrieved.amount_total, 2500)
+        self.assertEqual(retrieved.metadata['order_id'], '7')
+        self.assertEqual(retrieved.payment_status, 'paid')
+
+    def test_transient_failures_are_retried_with_one_idempotency_key(self):
+        self.stripe.fail_next(2)
+
+        with self.assertLogs('payments.gateway', 'WARNING'):
+            session = self.create_session()
+
+        self.assertEqual(len(self.stripe.sessions), 1)
+        keys = {key for method, path, key in self.stripe.requests}
+        self.assertEqual(len(self.stripe.requests), 3)
+        self.assertEqual(len(keys), 1)
+        self.assertGreaterEqual(gateway.metrics.snapshot()['checkout.sessions.create']['retries'], 2)
+        self.assertTrue(session.id.startswith('cs_test_fake'))
+
+    def test_retrieve_sends_no_idempotency_key(self):
+        session = self.create_session()
+
+        gateway.retrieve_checkout_session(session.id)
+
+        self.assertEqual(
+            [(method, key is not None) for method, path, key in self.stripe.requests],
+            [('POST', True), ('GET', False)]
+        )
+
+    def test_request_errors_are_not_retried(self):
+        with self.assertRaises(stripe.error.InvalidRequestError):
+            gateway.retrieve_checkout_session('cs_missing')
+        self.assertEqual(len(self.stripe.requests), 1)
+
+    def test_slow_responses_time_out(self):
+        self.stripe.delay = 1
+        with override_settings(STRIPE_MAX_RETRIES=0):
+            with self.assertRaises(stripe.error.APIConnectionError):
+                gateway.retrieve_checkout_session('cs_missing')
+
+    def test_circuit_opens_after_repeated_failures_and_recovers(self):
+        self.stripe.fail_next(6)
+        for _ in range(2):
+            with self.assertRaises(stripe.error.APIError), self.assertLogs('payments.gateway', 'WARNING'):
+                self.create_session()
+
+        with self.assertRaises(gateway.StripeUnavailable):
+            self.create_session()
+        self.assertEqual(len(self.stripe.requests), 6)
+
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 3600):
+            self.assertTrue(self.create_session().id)
+        self.assertEqual(gateway.get_breaker().state, 'closed')
+
+    def test_finalize_endpoint_uses_gateway(self):
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        product = Product.objects.create(name='Test Product', price=10.00, quantity=5)
+        client = APIClient()
+        client.force_authenticate(user=user)
+        client.post('/api/orders/cart/add/', {'product_id': product.id, 'quantity': 2})
+
+        url = client.post('/api/orders/checkout/').data['url']
+        session_id = url.rsplit('/', 1)[1]
+        self.stripe.pay(session_id)
+        response = client.post('/api/orders/finalize-order/', {'session_id': session_id})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 3)
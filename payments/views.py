@@ -1,7 +1,11 @@
+import json
+from datetime import timedelta
+
 import stripe
 from django.conf import settings
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from rest_framework import status, permissions
@@ -9,10 +13,11 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from orders.models import Order
-from payments.models import Payment, Refund
-
-stripe.api_key = settings.STRIPE_SECRET_KEY
+from orders.models import Order, StockReservation, hash_cart
+from payments import gateway
+from payments.fulfilment import fulfil_checkout_session
+from payments.models import Payment, Refund, WebhookEvent
+from products.models import InsufficientStock
 
 
 @api_view(['POST'])
@@ -30,8 +35,27 @@ def create_stripe_checkout_session(request):
     if order.status != Order.Status.PENDING:
         return Response({"error": "Order cannot be paid"}, status=status.HTTP_400_BAD_REQUEST)
 
+    # an unchanged order reuses its open session instead of creating another
+    items = list(order.items.all())
+    cart_hash = hash_cart(items)
+    url = order.reusable_checkout_url(cart_hash)
+    if url:
+        session_expires_at = order.stripe_session_expires_at
+    else:
+        # whole seconds, as Stripe stores it
+        now = timezone.now().replace(microsecond=0)
+        session_expires_at = now + timedelta(seconds=settings.STRIPE_CHECKOUT_SESSION_TTL)
+
+    # the stock stays held for as long as the session can be paid
+    try:
+        StockReservation.objects.hold_for_session(order, session_expires_at)
+    except InsufficientStock as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    if url:
+        return Response({"url": url})
+
     try:
-        session = stripe.checkout.Session.create(
+        session = gateway.create_checkout_session(
             payment_method_types=['card'],
             line_items=[{
                 'price_data': {
@@ -39,19 +63,26 @@ def create_stripe_checkout_session(request):
                     'product_data': {
                         'name': f"Order #{order.id}",
                     },
-                    'unit_amount': int(order.total_price() * 100),
+                    'unit_amount': int(sum(item.price * item.quantity for item in items) * 100),
                 },
                 'quantity': 1,
             }],
             mode='payment',
             success_url=f"{settings.FRONTEND_URL}/payment-success?session_id={{CHECKOUT_SESSION_ID}}",
             cancel_url=f"{settings.FRONTEND_URL}/cart",
-            metadata={'order_id': order.id},
+            expires_at=int(session_expires_at.timestamp()),
+            metadata={'order_id': order.id, 'cart_hash': cart_hash},
         )
-        return Response({"url": session.url})
     except Exception as e:
+        StockReservation.objects.release_abandoned(order)
         return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+    # the total above was computed from the order as of `order.version`
+    if not Order.objects.record_checkout_session(order, session, cart_hash):
+        StockReservation.objects.release_abandoned(order)
+        return Response({"error": "Order changed during checkout, please try again"}, status=status.HTTP_409_CONFLICT)
+    return Response({"url": session.url})
+
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
@@ -64,25 +95,15 @@ def finalize_order(request):
         return Response({"error": "session_id is required"}, status=status.HTTP_400_BAD_REQUEST)
 
     try:
-        session = stripe.checkout.Session.retrieve(session_id)
+        session = gateway.retrieve_checkout_session(session_id)
         order_id = session.metadata.get('order_id')
         order = get_object_or_404(Order, id=order_id, user=request.user)
 
         if session.payment_status != 'paid':
             return Response({"error": "Payment not completed"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Update order status
-        order.status = Order.Status.ORDERED
-        order.save()
-
-        # Create Payment record
-        Payment.objects.create(
-            order=order,
-            amount=order.total_price(),
-            payment_method=Payment.PaymentMethod.CARD,
-            stripe_payment_intent_id=session.payment_intent,
-            status=Payment.Status.SUCCEEDED,
-        )
+        # Applied once per session, whichever of webhook or finalize gets there first
+        fulfil_checkout_session(order.id, session.id, session.payment_intent, session.metadata.get('cart_hash'))
 
         return Response({"message": "Order finalized successfully", "order_id": order.id})
 
@@ -124,7 +145,7 @@ class CreateRefundView(APIView):
                     status=Refund.Status.PENDING
                 )
 
-                stripe_refund = stripe.Refund.create(
+                stripe_refund = gateway.create_refund(
                     payment_intent=payment.stripe_payment_intent_id,
                     amount=int(amount * 100),
                     reason='requested_by_customer',
@@ -174,24 +195,10 @@ def stripe_webhook(request):
     except stripe.error.SignatureVerificationError:
         return JsonResponse({'error': 'Invalid signature'}, status=400)
 
-    if event.type == 'checkout.session.completed':
-        session = event.data.object
-        order_id = session.metadata.get('order_id')
-        try:
-            order = Order.objects.get(id=order_id)
-            order.status = Order.Status.ORDERED
-            order.save()
-
-            Payment.objects.get_or_create(
-                order=order,
-                stripe_payment_intent_id=session.payment_intent,
-                defaults={
-                    'amount': order.total_price(),
-                    'payment_method': Payment.PaymentMethod.CARD,
-                    'status': Payment.Status.SUCCEEDED
-                }
-            )
-        except Order.DoesNotExist:
-            pass
-
-    return JsonResponse({'status': 'success'})
\ No newline at end of file
+    # persist and acknowledge; process_webhook_events applies it out of band
+    WebhookEvent.objects.get_or_create(
+        stripe_event_id=event.id,
+        defaults={'type': event.type, 'payload': json.loads(payload)}
+    )
+
+    return JsonResponse({'status': 'success'})
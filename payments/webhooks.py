@@ -0,0 +1,73 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from orders.models import Order
+from payments.fulfilment import fulfil_checkout_session
+from payments.models import WebhookEvent
+
+MAX_ATTEMPTS = 5
+# doubled after every failed attempt: 30s, 1m, 2m, 4m
+RETRY_BACKOFF = timedelta(seconds=30)
+
+
+def handle_checkout_session_completed(session):
+    metadata = session.get('metadata') or {}
+    try:
+        fulfil_checkout_session(
+            metadata.get('order_id'), session['id'], session.get('payment_intent'), metadata.get('cart_hash')
+        )
+    except Order.DoesNotExist:
+        pass
+
+
+HANDLERS = {
+    'checkout.session.completed': handle_checkout_session_completed,
+}
+
+
+def handle_event(payload):
+    """
+    Apply a raw Stripe event payload. Unknown event types are ignored.
+    """
+    handler = HANDLERS.get(payload['type'])
+    if handler:
+        handler(payload['data']['object'])
+
+
+def process_pending_events(batch_size=100):
+    """
+    Process one batch of due inbox events, oldest first, and return
+    (picked up, processed). Rows are claimed with SKIP LOCKED so several
+    workers can drain the inbox side by side. A failed event is pushed back
+    with exponential backoff rather than retried in the same pass.
+    """
+    processed = 0
+    with transaction.atomic():
+        now = timezone.now()
+        events = list(
+            WebhookEvent.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=WebhookEvent.Status.PENDING, next_attempt_at__lte=now)
+            .order_by('created_at')[:batch_size]
+        )
+        for event in events:
+            event.attempts += 1
+            try:
+                with transaction.atomic():
+                    handle_event(event.payload)
+            except Exception as e:
+                event.last_error = str(e)
+                if event.attempts >= MAX_ATTEMPTS:
+                    event.status = WebhookEvent.Status.FAILED
+                else:
+                    event.next_attempt_at = now + RETRY_BACKOFF * 2 ** (event.attempts - 1)
+            else:
+                event.status = WebhookEvent.Status.PROCESSED
+                event.last_error = None
+                event.processed_at = timezone.now()
+                processed += 1
+            event.save()
+
+    return len(events), processed
@@ -1,14 +1,76 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.core.exceptions import ValidationError
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from backend.pagination import EstimatedCountPaginator
 from .models import Product, ProductImage
 
+
+class ProductActionForm(ActionForm):
+    value = forms.IntegerField(required=False, help_text="Used by the discount and stock actions")
+
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name','product_model','product_dimension' , 'price', 'discount_percentage', 'quantity', 'is_active', 'created_at', 'updated_at')
+    list_display = ('id', 'name','product_model','product_dimension' , 'price', 'discount_percentage', 'quantity', 'is_active', 'created_by', 'created_at', 'updated_at')
     list_editable = ('discount_percentage', 'quantity', 'is_active','product_model')
     search_fields = ('name','product_model',)
     list_filter = ('is_active',)
     readonly_fields = ('created_at', 'updated_at')
+    list_select_related = ('created_by',)
+    # keeps the changelist from counting the whole catalog on every page
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 100
+
+    # each action is one set-based UPDATE over the selection, which may span
+    # every page of the current filter via "select all"
+    action_form = ProductActionForm
+    actions = ['activate', 'deactivate', 'set_discount', 'set_quantity', 'add_quantity']
+
+    def apply_update(self, request, queryset, **values):
+        updated = queryset.update(updated_at=timezone.now(), **values)
+        self.message_user(request, f"Updated {updated} products.", messages.SUCCESS)
+
+    def action_value(self, request, min_value=None, max_value=None):
+        field = forms.IntegerField(min_value=min_value, max_value=max_value)
+        try:
+            return field.clean(request.POST.get('value'))
+        except ValidationError as e:
+            self.message_user(request, f"Value: {' '.join(e.messages)}", messages.ERROR)
+            return None
+
+    @admin.action(description="Activate selected products")
+    def activate(self, request, queryset):
+        self.apply_update(request, queryset, is_active=True)
+
+    @admin.action(description="Deactivate selected products")
+    def deactivate(self, request, queryset):
+        self.apply_update(request, queryset, is_active=False)
+
+    @admin.action(description="Set discount percentage to value")
+    def set_discount(self, request, queryset):
+        value = self.action_value(request, min_value=0, max_value=100)
+        if value is not None:
+            self.apply_update(request, queryset, discount_percentage=value)
+
+    @admin.action(description="Set stock quantity to value")
+    def set_quantity(self, request, queryset):
+        value = self.action_value(request, min_value=0)
+        if value is not None:
+            self.apply_update(request, queryset, quantity=value)
+
+    @admin.action(description="Add value to stock quantity")
+    def add_quantity(self, request, queryset):
+        value = self.action_value(request)
+        if value is not None:
+            # negative values remove stock, but never below zero
+            self.apply_update(request, queryset, quantity=Greatest(F('quantity') + value, 0))
 
 @admin.register(ProductImage)
 class ProductImageAdmin(admin.ModelAdmin):
     list_display = ('id', 'product', 'image')
+    list_select_related = ('product',)
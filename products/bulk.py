@@ -0,0 +1,183 @@
+import csv
+import json
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+
+from . import cache
+from .models import Product
+
+# columns read by import_products and written by export_products, in order
+FIELDS = [
+    'id',
+    'product_model',
+    'name',
+    'product_dimension',
+    'description',
+    'price',
+    'discount_percentage',
+    'promotion_text',
+    'is_active',
+    'quantity',
+]
+REQUIRED = {'name', 'price'}
+
+
+class RowError(Exception):
+    def __init__(self, line, message):
+        self.line = line
+        super().__init__(f"Line {line}: {message}")
+
+
+def read_rows(stream, fmt):
+    """
+    Yield (line, row dict) from a CSV (with header) or JSON Lines text stream.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line, text in enumerate(stream, start=1):
+            if text.strip():
+                try:
+                    yield line, json.loads(text)
+                except ValueError as e:
+                    raise RowError(line, f"invalid JSON ({e})")
+
+
+def clean_row(line, row):
+    """
+    Convert one input row to a tuple in FIELDS order, applying model defaults
+    for blank columns and the model fields' own type validation.
+    """
+    values = []
+    for name in FIELDS:
+        field = Product._meta.get_field(name)
+        value = row.get(name)
+        if name == 'id' and (value is None or value == ''):
+            # no id: a new product, or one matched on product_model
+            values.append(None)
+            continue
+        if value is None or value == '':
+            if name in REQUIRED:
+                raise RowError(line, f"{name} is required")
+            value = field.get_default()
+        try:
+            value = field.clean(field.to_python(value), None)
+        except ValidationError as e:
+            raise RowError(line, f"{name}: {' '.join(e.messages)}")
+        values.append(value)
+    return tuple(values)
+
+
+UPDATE_SQL = """
+    UPDATE {table} p SET {updates}, updated_at = now()
+    FROM product_import i
+    WHERE i.id IS NOT NULL AND p.id = i.id
+    RETURNING p.id
+"""
+
+UPSERT_SQL = """
+    INSERT INTO {table} ({columns}, created_at, updated_at)
+    SELECT {columns}, now(), now() FROM product_import
+    WHERE id IS NULL
+    ON CONFLICT (product_model) WHERE product_model <> ''
+    DO UPDATE SET {updates}, updated_at = excluded.updated_at
+    RETURNING xmax = 0
+"""
+
+
+def load_chunk(rows):
+    """
+    COPY one chunk of (line, cleaned row) pairs into a temporary table, update
+    the rows that carry an id, and upsert the rest keyed on product_model.
+    Returns (created, updated).
+    """
+    # a product repeated within the chunk would hit the same row twice; last one wins
+    by_id, by_model, unkeyed = {}, {}, []
+    for line, row in rows:
+        if row[0] is not None:
+            by_id[row[0]] = line, row
+        elif row[1]:
+            by_model[row[1]] = line, row
+        else:
+            unkeyed.append((line, row))
+
+    table = Product._meta.db_table
+    columns = FIELDS[1:]
+    update_sql = UPDATE_SQL.format(
+        table=table,
+        updates=', '.join(f'{name} = i.{name}' for name in columns),
+    )
+    upsert_sql = UPSERT_SQL.format(
+        table=table,
+        columns=', '.join(columns),
+        updates=', '.join(f'{name} = excluded.{name}' for name in columns[1:]),
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE product_import ON COMMIT DROP AS "
+            f"SELECT {', '.join(FIELDS)} FROM {table} WITH NO DATA"
+        )
+        with cursor.copy(f"COPY product_import ({', '.join(FIELDS)}) FROM STDIN") as copy:
+            for _, row in (*by_id.values(), *by_model.values(), *unkeyed):
+                copy.write_row(row)
+        cursor.execute(update_sql)
+        found = {product_id for product_id, in cursor.fetchall()}
+        missing = [line for product_id, (line, _) in by_id.items() if product_id not in found]
+        if missing:
+            raise RowError(min(missing), "no product with this id")
+        cursor.execute(upsert_sql)
+        inserted = [created for created, in cursor.fetchall()]
+        # the chunk may run in a savepoint, where ON COMMIT hasn't fired yet
+        cursor.execute("DROP TABLE product_import")
+    return inserted.count(True), inserted.count(False) + len(found)
+
+
+def import_products(rows, chunk_size=5000, on_chunk=None):
+    """
+    Load (line, row) pairs chunk by chunk, each in its own transaction, so
+    memory stays bounded by the chunk size. Rows with an id update that
+    product, the others are upserted on product_model, and rows with neither
+    create a new product. `on_chunk(created, updated)` is called after every
+    chunk. Returns the (created, updated) totals.
+    """
+    created = updated = 0
+    rows = iter(rows)
+    try:
+        while chunk := [(line, clean_row(line, row)) for line, row in islice(rows, chunk_size)]:
+            chunk_created, chunk_updated = load_chunk(chunk)
+            created += chunk_created
+            updated += chunk_updated
+            if on_chunk:
+                on_chunk(created, updated)
+    finally:
+        # raw SQL skips the queryset hooks
+        if created or updated:
+            cache.invalidate()
+    return created, updated
+
+
+def export_products(stream, fmt):
+    """
+    Stream every product to a text stream as CSV (with header) or JSON Lines
+    using COPY TO, without loading the table into memory. Returns the row count.
+    """
+    query = f"SELECT {', '.join(FIELDS)} FROM {Product._meta.db_table} ORDER BY id"
+    if fmt == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(FIELDS)
+        write = writer.writerow
+    else:
+        query = f"SELECT row_to_json(p) FROM ({query}) p"
+        write = lambda row: stream.write(row[0] + '\n')
+
+    count = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        with cursor.copy(f"COPY ({query}) TO STDOUT") as copy:
+            for row in copy.rows():
+                write(row)
+                count += 1
+    return count
@@ -0,0 +1,67 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'products:version'
+HITS_KEY = 'products:cache:hits'
+MISSES_KEY = 'products:cache:misses'
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # start from a timestamp so a lost counter never revives old entries
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    """
+    Invalidate every cached product response at once.
+    """
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+def invalidate():
+    bump_version()
+    # bump again once the change is visible to other connections, so a
+    # response rebuilt from pre-commit data doesn't outlive the transaction
+    transaction.on_commit(bump_version)
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, None)
+
+
+def stats():
+    return {
+        'hits': cache.get(HITS_KEY, 0),
+        'misses': cache.get(MISSES_KEY, 0),
+    }
+
+
+def response_key(request, etag=''):
+    # the absolute URI covers host (image URLs are absolute) and query string;
+    # the ETag retires entries on writes that skip invalidate(), e.g. stock
+    digest = hashlib.sha1(f'{request.build_absolute_uri()}|{etag}'.encode()).hexdigest()
+    return f'products:{get_version()}:{digest}'
+
+
+def get_response_data(request, etag=''):
+    data = cache.get(response_key(request, etag))
+    _count(MISSES_KEY if data is None else HITS_KEY)
+    return data
+
+
+def set_response_data(request, data, etag=''):
+    cache.set(response_key(request, etag), data, settings.PRODUCT_CACHE_TIMEOUT)
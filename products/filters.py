@@ -0,0 +1,88 @@
+from django.contrib.postgres.aggregates import BoolOr
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db.models import BooleanField, Case, ExpressionWrapper, Q, When, Window
+from django.db.models.functions import Greatest
+from rest_framework import serializers
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+
+from .models import product_search_vector
+
+
+class ProductFilterParamsSerializer(serializers.Serializer):
+    is_active = serializers.BooleanField(required=False)
+    in_stock = serializers.BooleanField(required=False)
+    price__gte = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    price__lte = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    discounted_price__gte = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    discounted_price__lte = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    discount_percentage__gt = serializers.IntegerField(min_value=0, required=False)
+
+
+class ProductFilter(BaseFilterBackend):
+    """
+    Catalog filters: is_active, in_stock, price__gte/lte, discounted_price__gte/lte
+    and discount_percentage__gt. Invalid values are rejected with a 400.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        params = ProductFilterParamsSerializer(data=request.query_params.dict())
+        params.is_valid(raise_exception=True)
+        filters = dict(params.validated_data)
+
+        in_stock = filters.pop('in_stock', None)
+        if in_stock is not None:
+            queryset = queryset.filter(quantity__gt=0) if in_stock else queryset.filter(quantity=0)
+        return queryset.filter(**filters)
+
+
+class ProductOrderingFilter(OrderingFilter):
+    """
+    ?ordering= on a whitelisted set of fields, with id as a tie-breaker
+    so pages stay stable when many products share a value.
+    """
+    ordering_fields = ['price', 'discounted_price', 'discount_percentage', 'created_at', 'name']
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering and not {'id', '-id'} & set(ordering):
+            ordering = [*ordering, '-id' if ordering[0].startswith('-') else 'id']
+        return ordering
+
+
+class ProductSearchFilter(BaseFilterBackend):
+    """
+    ?q= full-text search over name, product_model and description, ranked by
+    relevance. When nothing matches, falls back to trigram similarity on
+    name and product_model so typos still find the product.
+    """
+    search_param = 'q'
+
+    def get_search_term(self, request):
+        return request.query_params.get(self.search_param, '').strip()
+
+    def filter_queryset(self, request, queryset, view):
+        term = self.get_search_term(request)
+        if not term:
+            return queryset
+
+        query = SearchQuery(term, config='english', search_type='websearch')
+        full_text = Q(search=query)
+        similar = Q(name__trigram_similar=term) | Q(product_model__trigram_similar=term)
+        # one query for both passes: trigram matches are only kept when
+        # no row matched the full-text query, which a window over the
+        # candidates tells us without probing for matches first
+        return (
+            queryset
+            .alias(search=product_search_vector())
+            .filter(full_text | similar)
+            .alias(
+                full_text_match=ExpressionWrapper(full_text, output_field=BooleanField()),
+                any_full_text_match=Window(BoolOr(full_text)),
+            )
+            .filter(Q(full_text_match=True) | Q(any_full_text_match=False))
+            .annotate(search_rank=Case(
+                When(full_text, then=SearchRank(product_search_vector(), query)),
+                default=Greatest(TrigramSimilarity('name', term), TrigramSimilarity('product_model', term)),
+            ))
+            .order_by('-search_rank', '-id')
+        )
@@ -0,0 +1,239 @@
+import hashlib
+import logging
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Q
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+from .models import ProductImage
+
+logger = logging.getLogger(__name__)
+
+# how long a worker may hold an image in PROCESSING before another takes it over
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+VARIANTS_DIR = 'products/variants'
+
+
+def available_formats():
+    return [fmt for fmt in settings.PRODUCT_IMAGE_FORMATS if features.check(fmt)]
+
+
+@lru_cache(maxsize=16384)
+def media_url(name):
+    """
+    URL of a stored product image or variant. Names are immutable and
+    AWS_QUERYSTRING_AUTH is off, so the storage URL never changes and is
+    only built once per name and process.
+    """
+    if settings.MEDIA_CDN_URL:
+        return settings.MEDIA_CDN_URL.rstrip('/') + '/' + name
+    return ProductImage._meta.get_field('image').storage.url(name)
+
+
+@receiver(setting_changed)
+def clear_media_url_cache(setting, **kwargs):
+    if setting in ('STORAGES', 'MEDIA_URL', 'MEDIA_CDN_URL'):
+        media_url.cache_clear()
+
+
+def generate_variants(product_image):
+    """
+    Render the configured widths of one image in each available format,
+    store them next to the original and return {format: {width: name}}.
+    Widths larger than the original are skipped rather than upscaled.
+    """
+    storage = product_image.image.storage
+    with product_image.image.open('rb') as f:
+        original = ImageOps.exif_transpose(Image.open(f))
+        original.load()
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA' if 'A' in original.getbands() else 'RGB')
+
+    widths = [w for w in settings.PRODUCT_IMAGE_WIDTHS if w <= original.width] or [original.width]
+    stem = PurePosixPath(product_image.image.name).stem
+
+    variants = {}
+    for width in widths:
+        resized = original.copy()
+        resized.thumbnail((width, width * 10), Image.Resampling.LANCZOS)
+        for fmt in available_formats():
+            buffer = BytesIO()
+            resized.save(buffer, format=fmt.upper(), quality=80)
+            name = storage.save(f'{VARIANTS_DIR}/{stem}_{width}.{fmt}', ContentFile(buffer.getvalue()))
+            variants.setdefault(fmt, {})[str(width)] = name
+    return variants
+
+
+def hash_file(f):
+    digest = hashlib.sha256()
+    for chunk in f.chunks():
+        digest.update(chunk)
+    f.seek(0)
+    return digest.hexdigest()
+
+
+def diff_images(existing, uploads):
+    """
+    Match an ordered list of uploads against a product's existing images by
+    content hash. Returns (kept, new, removed): kept images with their
+    `position` updated, (position, content_hash, file) tuples still to be
+    stored, and existing images no longer present. Repeated uploads of the
+    same file collapse into one image.
+    """
+    by_hash = {image.content_hash: image for image in existing if image.content_hash}
+    kept, new, seen = [], [], set()
+    for f in uploads:
+        content_hash = hash_file(f)
+        if content_hash in seen:
+            continue
+        position = len(seen)
+        seen.add(content_hash)
+        if content_hash in by_hash:
+            image = by_hash[content_hash]
+            image.position = position
+            kept.append(image)
+        else:
+            new.append((position, content_hash, f))
+    removed = [image for image in existing if image not in kept]
+    return kept, new, removed
+
+
+def store_uploads(files):
+    """
+    Stream uploaded files to the image storage in parallel, bounded by
+    PRODUCT_IMAGE_UPLOAD_WORKERS, and return their storage names in upload
+    order. Call this outside any DB transaction; if one upload fails, the
+    ones already stored are deleted again.
+    """
+    if not files:
+        return []
+    field = ProductImage._meta.get_field('image')
+    names = [field.generate_filename(None, f.name) for f in files]
+
+    def save(name, f):
+        return field.storage.save(name, f, max_length=field.max_length)
+
+    workers = min(settings.PRODUCT_IMAGE_UPLOAD_WORKERS, len(files))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(save, name, f) for name, f in zip(names, files)]
+
+    stored, error = [], None
+    for future in futures:
+        try:
+            stored.append(future.result())
+        except Exception as e:
+            error = error or e
+    if error:
+        delete_stored(stored)
+        raise error
+    return stored
+
+
+def delete_stored(names):
+    storage = ProductImage._meta.get_field('image').storage
+    for name in names:
+        storage.delete(name)
+
+
+def claim_pending_images(batch_size, claimed_at):
+    """
+    Mark up to `batch_size` pending images as PROCESSING and commit, so the
+    slow work that follows holds no row locks. Claims older than
+    CLAIM_TIMEOUT belong to a worker that died and are taken over.
+    """
+    Status = ProductImage.VariantStatus
+    with transaction.atomic():
+        ids = list(
+            ProductImage.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                Q(variants_status=Status.PENDING)
+                | Q(variants_status=Status.PROCESSING, variants_claimed_at__lt=claimed_at - CLAIM_TIMEOUT)
+            )
+            .order_by('created_at')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        ProductImage.objects.filter(id__in=ids).update(
+            variants_status=Status.PROCESSING, variants_claimed_at=claimed_at
+        )
+    return list(ProductImage.objects.filter(id__in=ids).order_by('created_at'))
+
+
+def process_pending_images(batch_size=20):
+    """
+    Generate variants for one batch of pending images and return how many
+    were picked up. Rows are claimed in a short transaction with SKIP LOCKED,
+    so several workers can run side by side, and each result is recorded in
+    its own short transaction once the image has been processed.
+    """
+    claimed_at = timezone.now()
+    images = claim_pending_images(batch_size, claimed_at)
+    for product_image in images:
+        try:
+            if not product_image.content_hash:
+                # backfills images uploaded before hashes were recorded
+                with product_image.image.open('rb') as f:
+                    product_image.content_hash = hash_file(f)
+            product_image.variants = generate_variants(product_image)
+            product_image.variants_status = ProductImage.VariantStatus.READY
+        except Exception:
+            logger.exception("Could not generate variants for ProductImage %s", product_image.id)
+            product_image.variants_status = ProductImage.VariantStatus.FAILED
+
+        with transaction.atomic():
+            # the image may have been replaced, or its claim taken over, meanwhile
+            still_ours = (
+                ProductImage.objects
+                .select_for_update()
+                .filter(pk=product_image.pk, variants_claimed_at=claimed_at)
+                .exists()
+            )
+            if still_ours:
+                # a regular save so the product's caches and validators are refreshed
+                product_image.save(update_fields=['content_hash', 'variants', 'variants_status'])
+        if not still_ours:
+            delete_stored(name for widths in product_image.variants.values() for name in widths.values())
+
+    return len(images)
+
+
+def sweep_orphaned_files(min_age, dry_run=False):
+    """
+    Delete originals and variants in storage that no ProductImage references
+    any more, e.g. after images were replaced on a product. Files younger
+    than `min_age` are left alone, since they may belong to an upload whose
+    row is not committed yet. Returns the names that were (or would be) deleted.
+    """
+    storage = ProductImage._meta.get_field('image').storage
+    referenced = set()
+    for name, variants in ProductImage.objects.values_list('image', 'variants').iterator():
+        referenced.add(name)
+        for widths in variants.values():
+            referenced.update(widths.values())
+
+    cutoff = timezone.now() - min_age
+    orphans = []
+    for directory in (ProductImage._meta.get_field('image').upload_to.rstrip('/'), VARIANTS_DIR):
+        try:
+            _, files = storage.listdir(directory)
+        except FileNotFoundError:
+            continue
+        for filename in files:
+            name = f'{directory}/{filename}'
+            if name not in referenced and storage.get_modified_time(name) < cutoff:
+                orphans.append(name)
+
+    if not dry_run:
+        delete_stored(orphans)
+    return orphans
@@ -0,0 +1,35 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from products.bulk import export_products
+
+
+class Command(BaseCommand):
+    help = "Write all products to a CSV or JSON Lines file that import_products can read back"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Destination file, or - for stdout")
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'jsonl'],
+            help="Output format; defaults to the file extension"
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        started = time.monotonic()
+
+        if path == '-':
+            count = export_products(self.stdout, fmt)
+        else:
+            with Path(path).open('w', newline='', encoding='utf-8') as stream:
+                count = export_products(stream, fmt)
+
+        elapsed = time.monotonic() - started
+        rate = count / max(elapsed, 1e-6)
+        # keep stdout clean when it carries the export itself
+        out = self.stderr if path == '-' else self.stdout
+        out.write(f"Exported {count} products in {elapsed:.1f}s ({rate:.0f} rows/s)")
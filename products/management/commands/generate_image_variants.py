@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.images import process_pending_images
+
+
+class Command(BaseCommand):
+    help = "Generate resized WebP/AVIF variants for newly uploaded product images"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument(
+            '--forever',
+            action='store_true',
+            help="Keep polling for new images instead of exiting once none are pending"
+        )
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds to sleep when nothing is pending")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            processed = process_pending_images(options['batch_size'])
+            total += processed
+            if processed:
+                continue
+            if not options['forever']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {total} product images"))
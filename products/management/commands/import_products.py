@@ -0,0 +1,49 @@
+import sys
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.bulk import RowError, import_products, read_rows
+
+
+class Command(BaseCommand):
+    help = "Create or update products from a CSV or JSON Lines file, matched on id or product_model"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for stdin")
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'jsonl'],
+            help="Input format; defaults to the file extension"
+        )
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Rows loaded per COPY and transaction")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        started = time.monotonic()
+
+        def report(created, updated):
+            total = created + updated
+            rate = total / max(time.monotonic() - started, 1e-6)
+            self.stdout.write(f"{total} rows loaded ({rate:.0f} rows/s)")
+
+        stream = sys.stdin if path == '-' else Path(path).open(newline='', encoding='utf-8')
+        try:
+            created, updated = import_products(
+                read_rows(stream, fmt),
+                chunk_size=options['chunk_size'],
+                on_chunk=report if options['verbosity'] > 1 else None
+            )
+        except RowError as e:
+            raise CommandError(f"{e} (earlier chunks were committed)")
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        elapsed = time.monotonic() - started
+        rate = (created + updated) / max(elapsed, 1e-6)
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {created} and updated {updated} products in {elapsed:.1f}s ({rate:.0f} rows/s)"
+        ))
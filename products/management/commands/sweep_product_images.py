@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from products.images import sweep_orphaned_files
+
+
+class Command(BaseCommand):
+    help = "Delete product image files in storage that are no longer referenced"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age-hours',
+            type=float,
+            default=1.0,
+            help="Only delete files older than this, to spare uploads still in flight"
+        )
+        parser.add_argument('--dry-run', action='store_true', help="List orphaned files without deleting them")
+
+    def handle(self, *args, **options):
+        orphans = sweep_orphaned_files(
+            timedelta(hours=options['min_age_hours']),
+            dry_run=options['dry_run']
+        )
+        for name in orphans:
+            self.stdout.write(name)
+
+        verb = "Found" if options['dry_run'] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {len(orphans)} orphaned files"))
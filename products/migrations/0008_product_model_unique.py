@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:16
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def rename_duplicate_product_models(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+
+    # the oldest product keeps the SKU; the others get their id appended so
+    # order history still points at them and they can be fixed up by hand
+    duplicated = (
+        Product.objects.exclude(product_model='')
+        .values('product_model').annotate(n=Count('id')).filter(n__gt=1)
+        .values_list('product_model', flat=True)
+    )
+    for product_model in duplicated:
+        keep, *extra = Product.objects.filter(product_model=product_model).order_by('id')
+        for product in extra:
+            suffix = f'-dup{product.id}'
+            Product.objects.filter(id=product.id).update(product_model=product_model[:100 - len(suffix)] + suffix)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_productimage_hash_position'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_product_models, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(condition=models.Q(('product_model', ''), _negated=True), fields=('product_model',), name='unique_product_model'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_product_model_unique'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='productimage',
+            name='productimage_pending_idx',
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='variants_claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='variants_status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('PROCESSING', 'Processing'), ('READY', 'Ready'), ('FAILED', 'Failed')], default='PENDING', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='productimage',
+            index=models.Index(condition=models.Q(('variants_status__in', ['PENDING', 'PROCESSING'])), fields=['created_at'], name='productimage_pending_idx'),
+        ),
+    ]
@@ -1,5 +1,88 @@
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.db import models, transaction
+from django.db.models import Case, F, Q, When
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from . import cache
+
+
+class InsufficientStock(Exception):
+    def __init__(self, products):
+        self.products = products
+        super().__init__(f"Not enough stock for {', '.join(products)}")
+
+
+def product_search_vector():
+    """
+    Weighted full-text document for a product. The search filter must use this
+    exact expression for Postgres to match it against the GIN index.
+    """
+    return (
+        SearchVector('name', weight='A', config='english')
+        + SearchVector('product_model', weight='A', config='english')
+        + SearchVector('description', weight='B', config='english')
+    )
+
+
+class ProductQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        # bulk updates skip auto_now, and the ETag is built from updated_at
+        kwargs.setdefault('updated_at', timezone.now())
+        # they also skip post_save, so drop cached product responses here
+        updated = super().update(**kwargs)
+        cache.invalidate()
+        return updated
+
+    def update_stock(self, quantity):
+        """
+        Write quantity without flushing the product response cache: the write
+        moves updated_at, and with it the ETag that cached responses are keyed by.
+        """
+        return super().update(quantity=quantity, updated_at=timezone.now())
+
+    def bulk_create(self, objs, *args, **kwargs):
+        created = super().bulk_create(objs, *args, **kwargs)
+        cache.invalidate()
+        return created
+
+    def decrement_stock(self, quantities):
+        """
+        Take {product_id: quantity} out of stock with a single conditional UPDATE.
+        Rows are locked in id order first so concurrent checkouts of overlapping
+        carts can't deadlock; they are held until the enclosing transaction ends.
+        """
+        if not quantities:
+            return
+        with transaction.atomic():
+            locked = self.select_for_update().filter(id__in=quantities).order_by('id')
+            stock = {pk: (name, available) for pk, name, available in locked.values_list('id', 'name', 'quantity')}
+            short = [
+                stock[pk][0] if pk in stock else str(pk)
+                for pk, quantity in quantities.items()
+                if pk not in stock or stock[pk][1] < quantity
+            ]
+            if short:
+                raise InsufficientStock(short)
+
+            covered = Q()
+            for pk, quantity in quantities.items():
+                covered |= Q(id=pk, quantity__gte=quantity)
+            updated = self.filter(covered).update_stock(
+                Case(*[When(id=pk, then=F('quantity') - quantity) for pk, quantity in quantities.items()])
+            )
+            if updated != len(quantities):
+                # rolls back the savepoint so no line is partially applied
+                raise InsufficientStock([name for name, _ in stock.values()])
+
+
+class ActiveProductManager(models.Manager.from_queryset(ProductQuerySet)):
+    """
+    Products visible to the public; served by the partial indexes on is_active.
+    """
+    def get_queryset(self):
+        return super().get_queryset().filter(is_active=True)
 
 
 class Product(models.Model):
@@ -11,6 +94,12 @@ class Product(models.Model):
     quantity = models.PositiveIntegerField(default=0)  # <-- new field
     discount_percentage = models.PositiveIntegerField(default=0)
     promotion_text = models.CharField(max_length=255, blank=True)
+    # maintained by Postgres so it can be indexed, filtered and sorted on
+    discounted_price = models.GeneratedField(
+        expression=F('price') - F('price') * F('discount_percentage') / 100,
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        db_persist=True
+    )
     is_active = models.BooleanField(default=True)
 
     created_by = models.ForeignKey(
@@ -20,21 +109,86 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
-    def discounted_price(self):
-        if self.discount_percentage > 0:
-            return self.price - (self.price * self.discount_percentage / 100)
-        return self.price
+    objects = ProductQuerySet.as_manager()
+    active = ActiveProductManager()
+
+    class Meta:
+        indexes = [
+            # backs cursor pagination of the catalog
+            models.Index(fields=['-created_at', '-id'], name='product_created_id_idx'),
+            # catalog filters and sorting mostly run over active products
+            models.Index(
+                fields=['price', 'id'],
+                condition=Q(is_active=True),
+                name='product_active_price_idx'
+            ),
+            models.Index(
+                fields=['-created_at', '-id'],
+                condition=Q(is_active=True),
+                name='product_active_created_idx'
+            ),
+            models.Index(
+                fields=['discounted_price', 'id'],
+                condition=Q(is_active=True),
+                name='product_active_disc_price_idx'
+            ),
+            models.Index(
+                fields=['discount_percentage'],
+                condition=Q(discount_percentage__gt=0),
+                name='product_on_sale_idx'
+            ),
+            GinIndex(product_search_vector(), name='product_search_idx'),
+            # trigram indexes back the typo-tolerant fallback search
+            GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='product_name_trgm_idx'),
+            GinIndex(fields=['product_model'], opclasses=['gin_trgm_ops'], name='product_model_trgm_idx'),
+        ]
+        constraints = [
+            # product_model is the SKU that bulk imports upsert on
+            models.UniqueConstraint(
+                fields=['product_model'],
+                condition=~Q(product_model=''),
+                name='unique_product_model'
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
 
 class ProductImage(models.Model):
+    class VariantStatus(models.TextChoices):
+        PENDING = "PENDING", "Pending"
+        PROCESSING = "PROCESSING", "Processing"
+        READY = "READY", "Ready"
+        FAILED = "FAILED", "Failed"
+
     product = models.ForeignKey(
         Product, related_name="images", on_delete=models.CASCADE
     )
     image = models.ImageField(upload_to="products/")
+    # sha256 of the original, used to keep unchanged images on re-upload
+    content_hash = models.CharField(max_length=64, blank=True)
+    position = models.PositiveIntegerField(default=0)
+    # {format: {width: storage name}}, filled in by generate_image_variants
+    variants = models.JSONField(default=dict, blank=True)
+    variants_status = models.CharField(
+        max_length=20,
+        choices=VariantStatus.choices,
+        default=VariantStatus.PENDING
+    )
+    # when a worker took the image for processing; stale claims are taken over
+    variants_claimed_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        ordering = ['position', 'id']
+        indexes = [
+            models.Index(
+                fields=['created_at'],
+                condition=Q(variants_status__in=['PENDING', 'PROCESSING']),
+                name='productimage_pending_idx'
+            ),
+        ]
+
     def __str__(self):
         return f"Image for {self.product.name}"
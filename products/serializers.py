@@ -1,20 +1,62 @@
 from django.db import transaction
 from rest_framework import serializers
+from .images import delete_stored, diff_images, media_url, store_uploads
 from .models import Product, ProductImage
 
 
 class ProductImageSerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = ProductImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'srcset']
 
-    def get_image(self, obj):
+    def absolute_url(self, name):
+        url = media_url(name)
         request = self.context.get('request')
-        if request:
-            return request.build_absolute_uri(obj.image.url)
-        return obj.image.url
+        # S3 and CDN URLs are already absolute
+        if request and url.startswith('/'):
+            return request.build_absolute_uri(url)
+        return url
+
+    def get_image(self, obj):
+        return self.absolute_url(obj.image.name)
+
+    def get_srcset(self, obj):
+        # {format: "url 320w, url 640w, ..."}, empty until variants are generated
+        return {
+            fmt: ', '.join(
+                f'{self.absolute_url(name)} {width}w'
+                for width, name in sorted(widths.items(), key=lambda item: int(item[0]))
+            )
+            for fmt, widths in obj.variants.items()
+        }
+
+    def get_thumbnail(self, obj):
+        # smallest WebP variant, or the original while variants are pending
+        widths = obj.variants.get('webp')
+        if widths:
+            return self.absolute_url(widths[min(widths, key=int)])
+        return self.get_image(obj)
+
+
+class ProductSummarySerializer(serializers.ModelSerializer):
+    """
+    Compact product representation for nested cart and order payloads.
+    """
+    thumbnail = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'price', 'thumbnail']
+
+    def get_thumbnail(self, obj):
+        # uses the prefetched images when available
+        images = obj.images.all()
+        if not images:
+            return None
+        return ProductImageSerializer(context=self.context).get_thumbnail(images[0])
 
 
 class ProductSerializer(serializers.ModelSerializer):
@@ -24,7 +66,9 @@ class ProductSerializer(serializers.ModelSerializer):
         write_only=True,
         required=False
     )
-    discounted_price = serializers.SerializerMethodField()
+    discounted_price = serializers.DecimalField(
+        max_digits=10, decimal_places=2, read_only=True, coerce_to_string=False
+    )
     created_by = serializers.StringRelatedField(read_only=True)
 
     class Meta:
@@ -48,40 +92,95 @@ class ProductSerializer(serializers.ModelSerializer):
             'images_upload'
         ]
 
-    def get_discounted_price(self, obj):
-        return obj.discounted_price()
-
     def create(self, validated_data):
         images_data = validated_data.pop('images_upload', [])
+        _, new, _ = diff_images([], images_data)
 
-        with transaction.atomic():
-            product = Product.objects.create(**validated_data)
-
-            for image in images_data:
-                ProductImage.objects.create(
-                    product=product,
-                    image=image
-                )
+        # upload first so the transaction only covers the row inserts
+        names = store_uploads([f for _, _, f in new])
+        try:
+            with transaction.atomic():
+                product = Product.objects.create(**validated_data)
+                ProductImage.objects.bulk_create([
+                    ProductImage(product=product, image=name, content_hash=content_hash, position=position)
+                    for (position, content_hash, _), name in zip(new, names)
+                ])
+        except Exception:
+            delete_stored(names)
+            raise
 
         return product
 
     def update(self, instance, validated_data):
         images_data = validated_data.pop('images_upload', None)
 
-        # update product fields
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
-        instance.save()
-
-        # replace images if new ones uploaded
+        # only files whose content is not already attached get stored;
+        # files of removed images are left to the sweep_product_images command
+        kept, new, removed = [], [], []
         if images_data is not None:
+            kept, new, removed = diff_images(list(instance.images.all()), images_data)
+        names = store_uploads([f for _, _, f in new])
+
+        try:
             with transaction.atomic():
-                instance.images.all().delete()
+                # update product fields
+                for attr, value in validated_data.items():
+                    setattr(instance, attr, value)
+                instance.save()
+
+                if removed:
+                    ProductImage.objects.filter(pk__in=[image.pk for image in removed]).delete()
+                if kept:
+                    ProductImage.objects.bulk_update(kept, ['position'])
+                ProductImage.objects.bulk_create([
+                    ProductImage(product=instance, image=name, content_hash=content_hash, position=position)
+                    for (position, content_hash, _), name in zip(new, names)
+                ])
+        except Exception:
+            delete_stored(names)
+            raise
+
+        # discounted_price is computed by the database
+        instance.refresh_from_db(fields=['discounted_price'])
+        return instance
 
-                for image in images_data:
-                    ProductImage.objects.create(
-                        product=instance,
-                        image=image
-                    )
 
-        return instance
+class ProductBulkListSerializer(serializers.ListSerializer):
+    def validate(self, attrs):
+        # SKU uniqueness is checked for the whole batch in one query
+        # instead of one UniqueValidator lookup per item
+        models = [item['product_model'] for item in attrs if item.get('product_model')]
+        duplicates = {model for model in models if models.count(model) > 1}
+        duplicates |= set(
+            Product.objects.filter(product_model__in=models).values_list('product_model', flat=True)
+        )
+        if duplicates:
+            raise serializers.ValidationError(
+                f"Products with these models already exist or repeat: {', '.join(sorted(duplicates))}"
+            )
+        return attrs
+
+    def create(self, validated_data):
+        return Product.objects.bulk_create([Product(**item) for item in validated_data], batch_size=500)
+
+
+class ProductBulkSerializer(serializers.ModelSerializer):
+    """
+    Image-less product rows for the admin bulk-create endpoint.
+    """
+    class Meta:
+        model = Product
+        fields = [
+            'id',
+            'name',
+            'product_model',
+            'product_dimension',
+            'description',
+            'price',
+            'discount_percentage',
+            'promotion_text',
+            'is_active',
+            'quantity',
+        ]
+        extra_kwargs = {'product_model': {'validators': []}}
+        list_serializer_class = ProductBulkListSerializer
@@ -0,0 +1,18 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import cache
+from .models import Product, ProductImage
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_cache(sender, **kwargs):
+    cache.invalidate()
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def touch_product(sender, instance, **kwargs):
+    # keeps Product.updated_at usable as a validator for image changes;
+    # the queryset update also invalidates the product cache
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
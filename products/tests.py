@@ -1,3 +1,704 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path, PurePosixPath
+from tempfile import TemporaryDirectory
+from unittest import mock
+from urllib.parse import urlencode
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from backend.pagination import EstimatedCountPaginator
+
+from . import cache, images
+from .images import media_url, store_uploads, sweep_orphaned_files
+from .filters import ProductFilter, ProductOrderingFilter
+from .models import Product, ProductImage
+from .serializers import ProductSerializer, ProductSummarySerializer
+from .views import ProductViewSet
+
+User = get_user_model()
+
+# keep uploaded test images out of S3
+LOCAL_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+@override_settings(STORAGES=LOCAL_STORAGES)
+class ProductListQueryCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='creator', password='testpass123')
+        self.client = APIClient()
+
+    def create_products(self, count):
+        for i in range(count):
+            product = Product.objects.create(
+                name=f'Product {i}',
+                price='10.00',
+                quantity=5,
+                created_by=self.user
+            )
+            ProductImage.objects.create(
+                product=product,
+                image=SimpleUploadedFile(f'p{i}.jpg', b'img', content_type='image/jpeg')
+            )
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(ctx.captured_queries)
+
+    def test_list_query_count_is_flat(self):
+        """Listing products costs the same number of queries regardless of catalog size"""
+        self.create_products(2)
+        small = self.count_list_queries()
+
+        self.create_products(10)
+        large = self.count_list_queries()
+
+        self.assertEqual(small, large)
+
+    def test_retrieve_loads_images_and_creator(self):
+        self.create_products(1)
+        product = Product.objects.get()
+
+        # validator aggregate, product with creator, images
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/products/{product.id}/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created_by'], 'creator')
+        self.assertEqual(len(response.data['images']), 1)
+
+
+class ProductResponseCacheTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = Product.objects.create(name='Mini Car', price='12.50', quantity=5)
+
+    def test_repeated_read_is_served_from_cache(self):
+        hits = cache.stats()['hits']
+        first = self.client.get(f'/api/products/{self.product.id}/')
+        self.assertEqual(first['X-Cache'], 'MISS')
+
+        # only the validator aggregate runs on a hit
+        with self.assertNumQueries(1):
+            second = self.client.get(f'/api/products/{self.product.id}/')
+
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(cache.stats()['hits'], hits + 1)
+
+    def test_save_invalidates_cached_responses(self):
+        self.client.get('/api/products/')
+
+        self.product.name = 'Mini Van'
+        self.product.save()
+        response = self.client.get('/api/products/')
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['name'], 'Mini Van')
+
+    def test_bulk_update_invalidates_cached_responses(self):
+        self.client.get(f'/api/products/{self.product.id}/')
+
+        Product.objects.filter(id=self.product.id).update(quantity=0)
+        response = self.client.get(f'/api/products/{self.product.id}/')
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['quantity'], 0)
+
+    def test_stock_update_refreshes_only_through_the_etag(self):
+        self.client.get(f'/api/products/{self.product.id}/')
+        version = cache.get_version()
+
+        Product.objects.filter(id=self.product.id).update_stock(2)
+        response = self.client.get(f'/api/products/{self.product.id}/')
+
+        self.assertEqual(cache.get_version(), version)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['quantity'], 2)
+
+
+@override_settings(STORAGES=LOCAL_STORAGES)
+class ProductConditionalGetTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = Product.objects.create(name='Mini Car', price='12.50', quantity=5)
+
+    def test_matching_etag_returns_304(self):
+        response = self.client.get('/api/products/')
+        self.assertNotIn('Last-Modified', response)
+
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_image_upload_changes_etag(self):
+        etag = self.client.get(f'/api/products/{self.product.id}/')['ETag']
+
+        ProductImage.objects.create(
+            product=self.product,
+            image=SimpleUploadedFile('car.jpg', b'img', content_type='image/jpeg')
+        )
+        response = self.client.get(f'/api/products/{self.product.id}/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_deactivating_a_product_is_not_answered_with_304(self):
+        Product.objects.create(name='Fire Truck', price='30.00', quantity=5)
+        self.client.get('/api/products/')
+
+        Product.objects.filter(id=self.product.id).update(is_active=False)
+        # a client that only revalidates by date, with a clock ahead of every updated_at
+        response = self.client.get('/api/products/', HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_bulk_update_changes_etag(self):
+        etag = self.client.get(f'/api/products/{self.product.id}/')['ETag']
+
+        Product.objects.filter(id=self.product.id).update(discount_percentage=10)
+        response = self.client.get(f'/api/products/{self.product.id}/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.roadster = Product.objects.create(
+            name='Classic Roadster', product_model='RS-100', price='20.00',
+            description='Die-cast convertible'
+        )
+        self.truck = Product.objects.create(
+            name='Fire Truck', product_model='FT-200', price='30.00',
+            description='Comes with a roadster-style ladder'
+        )
+        Product.objects.create(name='Police Car', product_model='PC-300', price='25.00')
+
+    def search(self, term):
+        response = self.client.get('/api/products/', {'q': term})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_results_are_ranked_by_relevance(self):
+        response = self.search('roadster')
+
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(
+            [p['id'] for p in response.data['results']],
+            [self.roadster.id, self.truck.id]
+        )
+
+    def test_product_model_is_searchable(self):
+        response = self.search('FT-200')
+
+        self.assertEqual([p['id'] for p in response.data['results']], [self.truck.id])
+
+    def test_typo_falls_back_to_trigram_similarity(self):
+        response = self.search('Roadstr')
+
+        self.assertEqual([p['id'] for p in response.data['results']], [self.roadster.id])
+
+    def test_search_runs_only_for_the_count_and_the_page(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.search('roadster')
+
+        self.assertEqual(response.data['count'], 2)
+        searches = [q['sql'] for q in queries.captured_queries if 'websearch_to_tsquery' in q['sql']]
+        self.assertEqual(len(searches), 2)
+
+
+class ProductFilterTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.cheap = Product.objects.create(name='Cheap', price='5.00', quantity=0)
+        self.mid = Product.objects.create(name='Mid', price='15.00', quantity=3, discount_percentage=10)
+        self.pricey = Product.objects.create(name='Pricey', price='50.00', quantity=1)
+        self.retired = Product.objects.create(name='Retired', price='15.00', quantity=9, is_active=False)
+
+    def ids(self, **params):
+        response = self.client.get('/api/products/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [p['id'] for p in response.data['results']]
+
+    def test_price_range_and_ordering(self):
+        self.assertEqual(
+            self.ids(price__gte='10', price__lte='50', is_active='true', ordering='-price'),
+            [self.pricey.id, self.mid.id]
+        )
+
+    def test_in_stock_and_discount_filters(self):
+        self.assertCountEqual(self.ids(in_stock='false'), [self.cheap.id])
+        self.assertEqual(self.ids(discount_percentage__gt='0'), [self.mid.id])
+
+    def test_ordering_ties_are_broken_by_id(self):
+        twin = Product.objects.create(name='Mid Twin', price='15.00', quantity=2)
+        self.assertEqual(
+            self.ids(ordering='price'),
+            [self.cheap.id, self.mid.id, twin.id, self.pricey.id]
+        )
+
+    def test_invalid_filter_value_is_rejected(self):
+        response = self.client.get('/api/products/', {'price__gte': 'cheap'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('price__gte', response.data)
+
+
+class DiscountedPriceTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.full = Product.objects.create(name='Full Price', price='20.00', quantity=1)
+        self.sale = Product.objects.create(name='On Sale', price='30.00', discount_percentage=50, quantity=1)
+
+    def test_discounted_price_is_computed_by_the_database(self):
+        self.assertEqual(Product.objects.get(id=self.sale.id).discounted_price, Decimal('15.00'))
+        self.assertEqual(Product.objects.get(id=self.full.id).discounted_price, Decimal('20.00'))
+
+    def test_order_and_filter_on_discounted_price(self):
+        response = self.client.get('/api/products/', {'ordering': 'discounted_price'})
+        self.assertEqual([p['id'] for p in response.data['results']], [self.sale.id, self.full.id])
+        self.assertEqual(response.data['results'][0]['discounted_price'], 15)
+
+        response = self.client.get('/api/products/', {'discounted_price__gte': '16'})
+        self.assertEqual([p['id'] for p in response.data['results']], [self.full.id])
+
+    def test_update_returns_recomputed_discounted_price(self):
+        staff = User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        self.client.force_authenticate(user=staff)
+
+        response = self.client.patch(f'/api/products/{self.full.id}/', {'discount_percentage': 25})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['discounted_price'], 15)
+
+
+class ActiveProductVisibilityTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.live = Product.objects.create(name='Live', price='5.00', quantity=1)
+        self.retired = Product.objects.create(name='Retired', price='5.00', quantity=1, is_active=False)
+
+    def test_public_reads_only_see_active_products(self):
+        response = self.client.get('/api/products/')
+        self.assertEqual([p['id'] for p in response.data['results']], [self.live.id])
+
+        response = self.client.get(f'/api/products/{self.retired.id}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_staff_see_inactive_products(self):
+        staff = User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        self.client.force_authenticate(user=staff)
+
+        response = self.client.get('/api/products/')
+
+        self.assertCountEqual([p['id'] for p in response.data['results']], [self.live.id, self.retired.id])
+
+
+class ProductFilterIndexTest(TestCase):
+    """The catalog filters are answered from the partial indexes"""
+
+    def explain(self, queryset=None, **params):
+        request = Request(APIRequestFactory().get('/api/products/', params))
+        queryset = Product.objects.all() if queryset is None else queryset
+        for backend in (ProductFilter(), ProductOrderingFilter()):
+            queryset = backend.filter_queryset(request, queryset, ProductViewSet())
+
+        with connection.cursor() as cursor:
+            # the test tables are tiny, so make the planner show its index choice
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            # and don't let table statistics left by other tests tip it towards bitmap scans
+            cursor.execute('SET LOCAL enable_bitmapscan = off')
+        # a page is what the API actually fetches
+        return queryset[:20].explain()
+
+    def test_active_price_range_uses_index(self):
+        plan = self.explain(is_active='true', price__gte='10', price__lte='50', ordering='price')
+        self.assertIn('product_active_price_idx', plan)
+
+    def test_active_newest_first_uses_index(self):
+        plan = self.explain(is_active='true', ordering='-created_at')
+        self.assertIn('product_active_created_idx', plan)
+
+    def test_public_catalog_page_uses_active_index(self):
+        plan = self.explain(Product.active.order_by('-created_at', '-id'))
+        self.assertIn('product_active_created_idx', plan)
+
+    def test_active_discounted_price_ordering_uses_index(self):
+        plan = self.explain(is_active='true', ordering='discounted_price')
+        self.assertIn('product_active_disc_price_idx', plan)
+
+    def test_discount_filter_uses_index(self):
+        plan = self.explain(discount_percentage__gt='0')
+        self.assertIn('product_on_sale_idx', plan)
+
+
+def png_upload(name='car.png', size=(1200, 800)):
+    buffer = BytesIO()
+    Image.new('RGB', size, 'red').save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(STORAGES=LOCAL_STORAGES, PRODUCT_IMAGE_WIDTHS=(320, 640, 1600), PRODUCT_IMAGE_FORMATS=('webp',))
+class ImageVariantPipelineTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = Product.objects.create(name='Mini Car', price='12.50', quantity=5)
+        self.image = ProductImage.objects.create(product=self.product, image=png_upload())
+
+    def test_upload_leaves_variants_to_the_worker(self):
+        self.assertEqual(self.image.variants_status, ProductImage.VariantStatus.PENDING)
+
+        image = self.client.get(f'/api/products/{self.product.id}/').data['images'][0]
+        self.assertEqual(image['srcset'], {})
+
+    def test_worker_generates_webp_widths_without_upscaling(self):
+        call_command('generate_image_variants', stdout=StringIO())
+
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.variants_status, ProductImage.VariantStatus.READY)
+        self.assertEqual(set(self.image.variants['webp']), {'320', '640'})
+        with self.image.image.storage.open(self.image.variants['webp']['320']) as f:
+            variant = Image.open(f)
+            self.assertEqual((variant.format, variant.size), ('WEBP', (320, 213)))
+
+    def test_serializer_exposes_srcset_and_small_thumbnail(self):
+        call_command('generate_image_variants', stdout=StringIO())
+
+        image = self.client.get(f'/api/products/{self.product.id}/').data['images'][0]
+        srcset = image['srcset']['webp'].split(', ')
+        self.assertEqual(len(srcset), 2)
+        self.assertTrue(srcset[0].endswith('.webp 320w'))
+
+        thumbnail = ProductSummarySerializer(self.product).data['thumbnail']
+        self.assertTrue(thumbnail.endswith('_320.webp'))
+
+    def test_unreadable_upload_is_marked_failed(self):
+        broken = ProductImage.objects.create(
+            product=self.product,
+            image=SimpleUploadedFile('broken.jpg', b'img', content_type='image/jpeg')
+        )
+
+        with self.assertLogs('products.images', level='ERROR'):
+            call_command('generate_image_variants', stdout=StringIO())
+
+        broken.refresh_from_db()
+        self.assertEqual(broken.variants_status, ProductImage.VariantStatus.FAILED)
+
+    def test_images_are_claimed_before_the_work_starts(self):
+        def generate(product_image):
+            # the claim is already recorded, so other workers skip the row without waiting on a lock
+            self.assertEqual(
+                ProductImage.objects.get(pk=product_image.pk).variants_status,
+                ProductImage.VariantStatus.PROCESSING
+            )
+            return {}
+
+        with mock.patch('products.images.generate_variants', side_effect=generate) as generate_variants:
+            call_command('generate_image_variants', stdout=StringIO())
+
+        self.assertEqual(generate_variants.call_count, 1)
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.variants_status, ProductImage.VariantStatus.READY)
+
+    def test_stale_claim_is_taken_over(self):
+        ProductImage.objects.filter(pk=self.image.pk).update(
+            variants_status=ProductImage.VariantStatus.PROCESSING,
+            variants_claimed_at=timezone.now() - timedelta(hours=1)
+        )
+
+        call_command('generate_image_variants', stdout=StringIO())
+
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.variants_status, ProductImage.VariantStatus.READY)
+
+    def test_image_deleted_while_processing_leaves_no_variants(self):
+        def generate(product_image):
+            variants = generate_variants(product_image)
+            ProductImage.objects.filter(pk=product_image.pk).delete()
+            return variants
+
+        generate_variants = images.generate_variants
+        with mock.patch('products.images.generate_variants', side_effect=generate):
+            call_command('generate_image_variants', stdout=StringIO())
+
+        storage = self.image.image.storage
+        self.assertEqual(storage.listdir(images.VARIANTS_DIR)[1], [])
+
+
+@override_settings(STORAGES=LOCAL_STORAGES, MEDIA_CDN_URL='')
+class MediaUrlTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        product = Product.objects.create(name='Mini Car', price='12.50', quantity=5)
+        for i in range(3):
+            ProductImage.objects.create(product=product, image=png_upload(f'car{i}.png', size=(40, 40)))
+
+    def test_storage_url_built_once_per_image(self):
+        storage = ProductImage._meta.get_field('image').storage
+        with mock.patch.object(type(storage._wrapped), 'url', autospec=True, return_value='https://bucket/x.png') as url:
+            for _ in range(2):
+                ProductSerializer(Product.objects.all(), many=True).data
+        self.assertEqual(url.call_count, 3)
+
+    def test_cdn_prefix(self):
+        with self.settings(MEDIA_CDN_URL='https://cdn.example.com/'):
+            image = self.client.get('/api/products/').data['results'][0]['images'][0]['image']
+        self.assertRegex(image, r'^https://cdn\.example\.com/products/car\d')
+        self.assertFalse(media_url(ProductImage.objects.first().image.name).startswith('https://cdn'))
+
+
+@override_settings(STORAGES=LOCAL_STORAGES, PRODUCT_IMAGE_UPLOAD_WORKERS=3)
+class ProductImageUploadTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        staff = User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        self.client.force_authenticate(user=staff)
+
+    def test_create_stores_all_uploads_in_order(self):
+        response = self.client.post('/api/products/', {
+            'name': 'Mini Car',
+            'price': '12.50',
+            'images_upload': [png_upload(f'car{i}.png', size=(40 + i, 40)) for i in range(5)],
+        }, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        images = list(ProductImage.objects.filter(product_id=response.data['id']).order_by('id'))
+        self.assertEqual([PurePosixPath(i.image.name).stem[:4] for i in images], ['car0', 'car1', 'car2', 'car3', 'car4'])
+        self.assertTrue(all(i.image.storage.exists(i.image.name) for i in images))
+
+    def test_failed_insert_removes_uploaded_files(self):
+        storage = ProductImage._meta.get_field('image').storage
+        before = storage.listdir('products')[1] if storage.exists('products') else []
+        with mock.patch.object(ProductImage.objects, 'bulk_create', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                self.client.post('/api/products/', {
+                    'name': 'Mini Car',
+                    'price': '12.50',
+                    'images_upload': [png_upload('car.png', size=(40, 40))],
+                }, format='multipart')
+
+        self.assertFalse(Product.objects.exists())
+        self.assertEqual(storage.listdir('products')[1], before)
+
+
+@override_settings(STORAGES=LOCAL_STORAGES)
+class IncrementalImageReplacementTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        staff = User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        self.client.force_authenticate(user=staff)
+        response = self.client.post('/api/products/', {
+            'name': 'Mini Car',
+            'price': '12.50',
+            'images_upload': [png_upload('front.png', size=(40, 40)), png_upload('back.png', size=(50, 40))],
+        }, format='multipart')
+        self.product_id = response.data['id']
+        self.front, self.back = ProductImage.objects.filter(product_id=self.product_id)
+        self.storage = self.front.image.storage
+
+    def replace(self, *uploads):
+        return self.client.patch(
+            f'/api/products/{self.product_id}/', {'images_upload': list(uploads)}, format='multipart'
+        )
+
+    def test_unchanged_images_are_kept_and_only_new_files_stored(self):
+        with mock.patch('products.serializers.store_uploads', wraps=store_uploads) as store:
+            response = self.replace(
+                png_upload('back.png', size=(50, 40)),
+                png_upload('side.png', size=(60, 40)),
+                png_upload('front.png', size=(40, 40)),
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([f.name for f in store.call_args.args[0]], ['side.png'])
+        images = list(ProductImage.objects.filter(product_id=self.product_id))
+        self.assertEqual([i.pk for i in images][::2], [self.back.pk, self.front.pk])
+        self.assertEqual([i.position for i in images], [0, 1, 2])
+        self.assertEqual([i['id'] for i in response.data['images']][::2], [self.back.pk, self.front.pk])
+
+    def test_removed_images_are_swept_from_storage(self):
+        self.replace(png_upload('back.png', size=(50, 40)))
+        self.assertFalse(ProductImage.objects.filter(pk=self.front.pk).exists())
+        self.assertTrue(self.storage.exists(self.front.image.name))
+
+        self.assertNotIn(self.front.image.name, sweep_orphaned_files(timedelta(hours=1)))
+        orphans = sweep_orphaned_files(timedelta(0))
+
+        self.assertIn(self.front.image.name, orphans)
+        self.assertNotIn(self.back.image.name, orphans)
+        self.assertFalse(self.storage.exists(self.front.image.name))
+        self.assertTrue(self.storage.exists(self.back.image.name))
+
+
+class ProductImportExportTest(TestCase):
+    CSV = (
+        "product_model,name,price,quantity,is_active,description\n"
+        "MC-1,Mini Car,12.50,5,True,\"Red, small\"\n"
+        "MC-2,Big Car,30.00,,False,\n"
+        ",Loose Part,1.00,3,,\n"
+    )
+
+    def run_import(self, path, *args):
+        out = StringIO()
+        call_command('import_products', path, *args, stdout=out)
+        return out.getvalue()
+
+    def write(self, name, text):
+        path = Path(self.tmp.name) / name
+        path.write_text(text, encoding='utf-8')
+        return str(path)
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_csv_import_creates_then_upserts_on_product_model(self):
+        path = self.write('products.csv', self.CSV)
+        self.assertIn('Created 3 and updated 0 products', self.run_import(path, '--chunk-size', '2'))
+
+        car = Product.objects.get(product_model='MC-1')
+        self.assertEqual((car.price, car.quantity, car.description), (Decimal('12.50'), 5, 'Red, small'))
+        self.assertFalse(Product.objects.get(product_model='MC-2').is_active)
+
+        path = self.write('update.jsonl', '{"product_model": "MC-1", "name": "Mini Car", "price": "9.99"}\n')
+        self.assertIn('Created 0 and updated 1 products', self.run_import(path))
+        car.refresh_from_db()
+        self.assertEqual((car.price, car.quantity), (Decimal('9.99'), 0))
+        self.assertEqual(Product.objects.count(), 3)
+
+    def test_invalid_row_reports_its_line(self):
+        path = self.write('bad.csv', "product_model,name,price\nMC-1,Mini Car,cheap\n")
+        with self.assertRaisesMessage(CommandError, 'Line 2: price'):
+            self.run_import(path)
+        self.assertFalse(Product.objects.exists())
+
+    def test_export_round_trips_through_import(self):
+        self.run_import(self.write('products.csv', self.CSV))
+        for fmt in ('csv', 'jsonl'):
+            path = str(Path(self.tmp.name) / f'export.{fmt}')
+            call_command('export_products', path, stdout=StringIO())
+            Product.objects.update(price='1.00')
+
+            self.assertIn('Created 0 and updated 3 products', self.run_import(path))
+            self.assertEqual(Product.objects.count(), 3)
+            self.assertEqual(Product.objects.get(product_model='MC-1').price, Decimal('12.50'))
+            self.assertEqual(Product.objects.get(product_model='').price, Decimal('1.00'))
+
+    def test_rows_with_an_id_update_that_product(self):
+        self.run_import(self.write('products.csv', self.CSV))
+        part = Product.objects.get(name='Loose Part')
+
+        path = self.write('ids.csv', f"id,product_model,name,price\n{part.id},LP-1,Loose Part,2.00\n")
+        self.assertIn('Created 0 and updated 1 products', self.run_import(path))
+        part.refresh_from_db()
+        self.assertEqual((part.product_model, part.price), ('LP-1', Decimal('2.00')))
+
+        path = self.write('unknown.csv', f"id,name,price\n{part.id},Loose Part,3.00\n0,Ghost,1.00\n")
+        with self.assertRaisesMessage(CommandError, 'Line 3: no product with this id'):
+            self.run_import(path)
+        part.refresh_from_db()
+        self.assertEqual(part.price, Decimal('2.00'))
+
+
+class ProductBulkCreateTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.staff = User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        self.client.force_authenticate(user=self.staff)
+
+    def test_creates_batch_in_constant_queries(self):
+        items = [{'name': f'Car {i}', 'product_model': f'MC-{i}', 'price': '10.00'} for i in range(50)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/products/bulk/', items, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 50)
+        self.assertEqual(Product.objects.filter(created_by=self.staff).count(), 50)
+        self.assertLess(len(queries), 10)
+
+    def test_rejects_existing_or_repeated_models(self):
+        Product.objects.create(name='Mini Car', product_model='MC-1', price='5.00')
+        items = [
+            {'name': 'A', 'product_model': 'MC-1', 'price': '1.00'},
+            {'name': 'B', 'product_model': 'MC-2', 'price': '1.00'},
+            {'name': 'C', 'product_model': 'MC-2', 'price': '1.00'},
+        ]
+        response = self.client.post('/api/products/bulk/', items, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('MC-1, MC-2', str(response.data))
+        self.assertEqual(Product.objects.count(), 1)
+
+    def test_requires_staff(self):
+        self.client.force_authenticate(user=User.objects.create_user(username='shopper', password='testpass123'))
+        response = self.client.post('/api/products/bulk/', [{'name': 'A', 'price': '1.00'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ProductAdminTest(TestCase):
+    def setUp(self):
+        admin_user = User.objects.create_superuser(username='admin', password='testpass123')
+        self.client.force_login(admin_user)
+        self.products = [
+            Product.objects.create(name=f'Car {i}', price='10.00', quantity=3, is_active=i % 2 == 0)
+            for i in range(4)
+        ]
+
+    def run_action(self, action, value='', **params):
+        return self.client.post('/admin/products/product/' + ('?' + urlencode(params) if params else ''), {
+            'action': action,
+            'value': value,
+            'select_across': '1',
+            'index': '0',
+            '_selected_action': [p.pk for p in self.products],
+        })
+
+    def test_discount_applies_to_whole_filtered_selection_in_one_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.run_action('set_discount', '25', is_active__exact='1')
+
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(
+            sorted(Product.objects.values_list('is_active', 'discount_percentage')),
+            [(False, 0), (False, 0), (True, 25), (True, 25)]
+        )
+
+    def test_add_quantity_never_goes_negative(self):
+        self.products[0].quantity = 1
+        self.products[0].save()
+        self.run_action('add_quantity', '-2')
+        self.assertEqual(sorted(Product.objects.values_list('quantity', flat=True)), [0, 1, 1, 1])
+
+    def test_invalid_value_changes_nothing(self):
+        response = self.run_action('set_discount', '150')
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Product.objects.filter(discount_percentage__gt=0).exists())
+
+    def test_changelist_uses_row_estimate_for_large_unfiltered_tables(self):
+        paginator = EstimatedCountPaginator(Product.objects.order_by('id'), 100)
+        with mock.patch.object(EstimatedCountPaginator, 'exact_count_below', 0), \
+                CaptureQueriesContext(connection) as queries:
+            paginator.count
+        self.assertIn('reltuples', queries.captured_queries[0]['sql'])
+
+        filtered = EstimatedCountPaginator(Product.objects.filter(is_active=True).order_by('id'), 100)
+        self.assertEqual(filtered.count, 2)
+        self.assertEqual(self.client.get('/admin/products/product/').status_code, 200)
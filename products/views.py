@@ -10,18 +10,96 @@
 #
 #     def perform_create(self, serializer):
 #         serializer.save(created_by=self.request.user)
-from rest_framework import viewsets
+from functools import partial
+
+from django.db import transaction
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from backend.conditional import ConditionalGetMixin
+from backend.pagination import RankedResultsPagination
+from . import cache
 from .models import Product
-from .serializers import ProductSerializer
+from .filters import ProductFilter, ProductOrderingFilter, ProductSearchFilter
+from .serializers import ProductBulkSerializer, ProductSerializer
 from .permissions import IsAdminUserOrReadOnly
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAdminUserOrReadOnly]
+    filter_backends = [ProductFilter, ProductSearchFilter, ProductOrderingFilter]
+    BULK_CREATE_MAX = 1000
+
+    @property
+    def paginator(self):
+        # search results are ordered by rank, which a cursor can't follow
+        if not hasattr(self, '_paginator') and ProductSearchFilter().get_search_term(self.request):
+            self._paginator = RankedResultsPagination()
+        return super().paginator
+
+    def get_queryset(self):
+        # Only staff see inactive products
+        manager = Product.objects if self.request.user.is_staff else Product.active
+        # Load creators and images up front so serialization doesn't hit the DB per product
+        return (
+            manager
+            .select_related('created_by')
+            .prefetch_related('images')
+        )
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_get(partial(self.cached_response, super().list), request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_get(partial(self.cached_response, super().retrieve), request, *args, **kwargs)
+
+    def get_validator_queryset(self, request, *args, **kwargs):
+        # image changes touch the product's updated_at, so products alone are enough.
+        # ?q= only narrows the products (and is part of the URI in the ETag), so the
+        # validators skip the full-text query and still see every change
+        queryset = self.get_queryset()
+        for backend in self.filter_backends:
+            if backend is not ProductSearchFilter:
+                queryset = backend().filter_queryset(request, queryset, self)
+        if self.lookup_field in kwargs:
+            queryset = queryset.filter(**{self.lookup_field: kwargs[self.lookup_field]})
+        return queryset
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        """
+        Serve public reads from the product response cache.
+        Staff see the same payload but always bypass the cache.
+        """
+        if request.user.is_staff:
+            return handler(request, *args, **kwargs)
+
+        data = cache.get_response_data(request, self.etag)
+        if data is not None:
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set_response_data(request, response.data, self.etag)
+        response['X-Cache'] = 'MISS'
+        return response
 
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
 
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_create(self, request):
+        """
+        Create up to BULK_CREATE_MAX image-less products from a JSON list
+        with batched INSERTs. The whole list is rejected if any item is invalid.
+        """
+        serializer = ProductBulkSerializer(
+            data=request.data, many=True, max_length=self.BULK_CREATE_MAX, context=self.get_serializer_context()
+        )
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            serializer.save(created_by=request.user)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     def get_serializer_context(self):
         return {"request": self.request}
\ No newline at end of file